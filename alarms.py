@@ -0,0 +1,146 @@
+import os, queue, subprocess, threading, time
+from collections import deque
+from typing import NamedTuple
+
+import numpy as np
+
+# rows of the alarm state of a device, each of them covers every cell
+OV, UV, OT, IMBALANCE = range(4)
+RULE_NAMES = ("OV", "UV", "OT", "IMBALANCE")
+
+
+class AlarmEvent(NamedTuple):
+    ts: float
+    bms_id: int
+    rule: str
+    cell: int
+    value: float
+    raised: bool
+
+    def __str__(self):
+        when = time.strftime("%H:%M:%S", time.localtime(self.ts))
+        return f"{when} 0x{self.bms_id:x} {self.rule} cell {self.cell + 1}: {self.value:g} " + \
+               ("RAISED" if self.raised else "cleared")
+
+
+class AlarmState:
+    def __init__(self, cells:int):
+        self.active = np.zeros((len(RULE_NAMES), cells), dtype=bool)
+        # consecutive cycles the condition disagreed with the active state
+        self.pending = np.zeros((len(RULE_NAMES), cells), dtype=np.int32)
+
+
+class AlarmEngine(threading.Thread):
+    # Threshold rules over the cells of a device, evaluated once per status cycle as whole-array
+    # comparisons: a (rules x cells) matrix of values against column vectors of limits. An alarm is
+    # raised when its limit is crossed and cleared only past the hysteresis band, either way only
+    # after the condition held for debounce cycles. Log file and hook run on this thread.
+    DEFAULT_OV = 4250
+    DEFAULT_UV = 2800
+    DEFAULT_OT = 55
+    DEFAULT_IMBALANCE = 50
+    DEFAULT_HYSTERESIS_V = 20
+    DEFAULT_HYSTERESIS_T = 2
+    DEFAULT_DEBOUNCE = 3
+    LOG_SIZE = 1000
+    HOOK_TIMEOUT = 10.0
+
+    def __init__(self, cells:int=16, ov:float=DEFAULT_OV, uv:float=DEFAULT_UV, ot:float=DEFAULT_OT,
+                 imbalance:float=DEFAULT_IMBALANCE, hysteresis_v:float=DEFAULT_HYSTERESIS_V,
+                 hysteresis_t:float=DEFAULT_HYSTERESIS_T, debounce:int=DEFAULT_DEBOUNCE, hook:str=None,
+                 log_path:str=None):
+        super().__init__(group=None, name="alarm_engine", daemon=True)
+        # width of the state of a device not evaluated yet, the others follow their cell arrays
+        self.cells = cells
+        # voltages in mV, temperatures in C, the imbalance row holds each cell's distance from the lowest
+        self.limits = np.array([ov, uv, ot, imbalance], dtype=np.float64)[:, None]
+        self.clears = np.array([ov - hysteresis_v, uv + hysteresis_v, ot - hysteresis_t, imbalance - hysteresis_v],
+                               dtype=np.float64)[:, None]
+        self.above = np.array([True, False, True, True])[:, None]
+        self.debounce = max(debounce, 1)
+        self.hook = hook
+        self.log_path = log_path
+        self.log = deque(maxlen=self.LOG_SIZE)
+        self.error = None
+        self.__states = {}
+        self.__events = queue.Queue()
+
+    def evaluate(self, bms_id:int, v:np.ndarray, t:np.ndarray, ts:float=None) -> list:
+        # -> AlarmEvents of the alarms raised or cleared by this cycle
+        cells = len(v)
+        state = self.__states.get(bms_id)
+        if state is None or state.active.shape[1] != cells:
+            # first cycle of the device, or it reported another cell count: start over
+            state = self.__states[bms_id] = AlarmState(cells)
+        values = np.empty((len(RULE_NAMES), cells))
+        values[OV] = values[UV] = v
+        values[OT] = t
+        with np.errstate(invalid="ignore"):
+            values[IMBALANCE] = v - np.nanmin(v) if not np.isnan(v).all() else np.nan
+            # NaN, a cell without samples, is neither over nor back and keeps its state
+            over = np.where(self.above, values > self.limits, values < self.limits)
+            back = np.where(self.above, values <= self.clears, values >= self.clears)
+        disagree = np.where(state.active, back, over)
+        state.pending = np.where(disagree, state.pending + 1, 0)
+        flip = state.pending >= self.debounce
+        if not flip.any():
+            return []
+        state.active ^= flip
+        state.pending[flip] = 0
+        ts = time.time() if ts is None else ts
+        events = [AlarmEvent(ts, bms_id, RULE_NAMES[rule], int(cell), float(values[rule, cell]), bool(state.active[rule, cell]))
+                  for rule, cell in zip(*np.nonzero(flip))]
+        self.log.extend(events)
+        if self.hook or self.log_path:
+            for event in events:
+                self.__events.put(event)
+        return events
+
+    def active(self, bms_id:int) -> np.ndarray:
+        # -> (rules x cells) bool, all clear for a device not evaluated yet
+        state = self.__states.get(bms_id)
+        return state.active.copy() if state is not None else np.zeros((len(RULE_NAMES), self.cells), dtype=bool)
+
+    def summary(self, bms_id:int) -> str:
+        active = self.active(bms_id)
+        parts = [f"{RULE_NAMES[rule]}: " + ",".join(str(cell + 1) for cell in np.nonzero(active[rule])[0])
+                 for rule in range(len(RULE_NAMES)) if active[rule].any()]
+        return " | ".join(parts)
+
+    def forget(self, bms_id:int):
+        self.__states.pop(bms_id, None)
+
+    def stop(self):
+        self.__events.put(None)
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        # events queued before stop() are still written and reported
+        while True:
+            event = self.__events.get()
+            if event is None:
+                break
+            if self.log_path:
+                self.__write(event)
+            if self.hook:
+                self.__run_hook(event)
+
+    def __write(self, event:AlarmEvent):
+        try:
+            with open(self.log_path, "a") as f:
+                f.write(str(event) + "\n")
+            self.error = None
+        except OSError as e:
+            self.error = e
+
+    def __run_hook(self, event:AlarmEvent):
+        # the event goes to the command in the environment, its output must not garble the screen
+        env = dict(os.environ, BMS_ALARM=event.rule, BMS_ID=f"0x{event.bms_id:x}", BMS_CELL=str(event.cell + 1),
+                   BMS_VALUE=f"{event.value:g}", BMS_STATE="raised" if event.raised else "cleared")
+        try:
+            subprocess.run(self.hook, shell=True, env=env, timeout=self.HOOK_TIMEOUT,
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            self.error = None
+        except (OSError, subprocess.SubprocessError) as e:
+            self.error = e
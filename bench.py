@@ -0,0 +1,169 @@
+import argparse, json, platform, random, time, tracemalloc
+from unittest.mock import MagicMock
+
+from asciimatics.screen import Screen
+from asciimatics.scene import Scene
+
+import example, console
+from simulator import SimulatedSource, SimulatedDevice
+
+
+def headless_screen(width:int, height:int):
+    # frames paint into their own canvas, the screen only has to take the block transfer
+    screen = MagicMock(spec=Screen, colours=256, unicode_aware=False)
+    screen.width = width
+    screen.height = height
+    return screen
+
+
+class Bench:
+    def __init__(self, width:int=120, height:int=40, cells:int=16):
+        self.screen = headless_screen(width, height)
+        self.cells = cells
+        # the dongle is never started: handlers are driven directly, no threads involved
+        self.dongle = console.ConsoleDongle(SimulatedSource(cells), callbacks={}, cells=cells)
+        self.dongle.batch_trace = True
+        self.dongle.update_devices()
+        self.main = console.BmsToolFrame(self.screen, self.dongle.callbacks, {"first_run": False})
+        self.flags = console.FlagFrame(self.screen, self.dongle.callbacks)
+        self.main_scene = Scene([self.main], -1, name="Main")
+        self.main_scene.reset()
+        Scene([self.flags], -1, name="FlagTable").reset()
+        self.device = SimulatedDevice(1, cells)
+        self.trace_seq = 0
+
+    def trace_chunk(self) -> str:
+        self.trace_seq += 1
+        return f"BMS #{self.trace_seq} I={random.randrange(-5000, 5000)} ".ljust(62, "-") + "\n"
+
+    @staticmethod
+    def rate(fn, seconds:float) -> dict:
+        count = 0
+        started = time.perf_counter()
+        deadline = started + seconds
+        while time.perf_counter() < deadline:
+            for _ in range(100):
+                fn()
+            count += 100
+        elapsed = time.perf_counter() - started
+        return {"calls": count, "per_second": count / elapsed, "us_per_call": elapsed / count * 1e6}
+
+    def handlers(self, seconds:float) -> dict:
+        cell = [0]
+
+        def status():
+            cell[0] = (cell[0] + 1) % self.cells
+            self.main.on_status_handler(self.device.cell(cell[0]))
+
+        def flag():
+            self.device.step()
+            self.flags.on_flag_handler(self.device.status())
+
+        view = self.main.widgets["traces_box"]
+
+        def trace():
+            # one chunk into the store and the view drawn again, as it follows the end
+            view.store.append(self.trace_chunk())
+            view.update(self.trace_seq)
+
+        def trace_pipeline():
+            # decoding, store and UI hand-over of one chunk, delivered once per 20 chunks as by a render tick
+            self.dongle.get_trace_handler({"s": self.trace_chunk().encode("utf-8")})
+            if self.trace_seq % 20 == 0:
+                self.dongle.poll()
+
+        def pipeline():
+            # the whole dongle path of one cell answer: device state, history, pack stats, frames
+            cell[0] = (cell[0] + 1) % self.cells
+            self.dongle.on_status(None, self.device.cell(cell[0]))
+
+        return {
+            "on_status_handler": self.rate(status, seconds),
+            "on_flag_handler": self.rate(flag, seconds),
+            "trace_append_render": self.rate(trace, seconds),
+            "dongle_trace_pipeline": self.rate(trace_pipeline, seconds),
+            "dongle_status_pipeline": self.rate(pipeline, seconds),
+        }
+
+    def render(self, frames:int) -> float:
+        started = time.perf_counter()
+        for i in range(frames):
+            self.main.update(i)
+            self.main.canvas.refresh()
+        return (time.perf_counter() - started) / frames * 1000
+
+    def render_vs_trace(self, sizes:list, frames:int) -> list:
+        results = []
+        done = 0
+        for size in sizes:
+            while done < size:
+                self.dongle.get_trace_handler({"s": self.trace_chunk().encode("utf-8")})
+                done += 1
+            results.append({"trace_lines": size, "ms_per_frame": self.render(frames)})
+        return results
+
+    def session(self, cycles:int, samples:int) -> list:
+        # memory over a long synthetic session: a status cycle plus some trace per step
+        tracemalloc.start()
+        base = tracemalloc.get_traced_memory()[0]
+        results = []
+        for i in range(1, cycles + 1):
+            self.device.step()
+            self.dongle.on_status(None, self.device.status())
+            for cell in range(self.cells):
+                self.dongle.on_status(None, self.device.cell(cell))
+            self.dongle.get_trace_handler({"s": self.trace_chunk().encode("utf-8")})
+            if i % max(cycles // samples, 1) == 0:
+                results.append({"cycle": i, "kib": (tracemalloc.get_traced_memory()[0] - base) / 1024})
+        tracemalloc.stop()
+        return results
+
+
+def compare(old:dict, new:dict):
+    for name, result in new["handlers"].items():
+        if name in old.get("handlers", {}):
+            ratio = result["per_second"] / old["handlers"][name]["per_second"]
+            print(f"{name:>24}: {result['per_second']:12.0f}/s  x{ratio:.2f}")
+    old_render = {r["trace_lines"]: r for r in old.get("render", [])}
+    for result in new["render"]:
+        if result["trace_lines"] in old_render:
+            ratio = result["ms_per_frame"] / old_render[result["trace_lines"]]["ms_per_frame"]
+            print(f"{'render %d lines' % result['trace_lines']:>24}: {result['ms_per_frame']:10.3f} ms  x{ratio:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog='Bms3ToolBench', description='Headless benchmark of the Bms3ToolConsole handler and render path')
+    parser.add_argument('-o', '--output', type=str, default='bench.json', help='Result file, by default: %(default)s')
+    parser.add_argument('--compare', type=str, metavar='FILE', help='Print the change against an earlier result file')
+    parser.add_argument('--seconds', type=float, default=1.0, help='Duration of every handler measurement, by default: %(default)s')
+    parser.add_argument('--frames', type=int, default=50, help='Frames rendered per measurement, by default: %(default)s')
+    parser.add_argument('--trace-sizes', type=str, default='0,1000,5000,10000', help='Trace lengths to measure rendering at, by default: %(default)s')
+    parser.add_argument('--cycles', type=int, default=20000, help='Status cycles of the synthetic session, by default: %(default)s')
+    parser.add_argument('--cells', type=int, default=16, help='Cells per device, by default: %(default)s')
+    parser.add_argument('--width', type=int, default=120)
+    parser.add_argument('--height', type=int, default=40)
+    args = parser.parse_args()
+
+    random.seed(0)
+    bench = Bench(args.width, args.height, args.cells)
+    results = {
+        "version": example.VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "params": vars(args),
+        "handlers": bench.handlers(args.seconds),
+        "render": bench.render_vs_trace([int(x) for x in args.trace_sizes.split(",")], args.frames),
+        "memory": Bench(args.width, args.height, args.cells).session(args.cycles, 20),
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results)
+    else:
+        print(json.dumps({k: results[k] for k in ("handlers", "render")}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
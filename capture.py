@@ -0,0 +1,172 @@
+import os, mmap, json, queue, struct, threading, time
+
+from sources import DeviceSource
+
+MAGIC = b"BMS3CAP\x01"
+
+KIND_STATUS = 1
+KIND_INFO = 2
+KIND_TRACE = 3
+# status frame of one cell packed as id, v, t instead of json, most of a capture is these
+KIND_CELL = 4
+
+# payload length, timestamp, kind, target serial (0 for the only/default device)
+RECORD_HEADER = struct.Struct("<IdBI")
+CELL = struct.Struct("<Hii")
+
+
+def encode_record(kind:int, target, data, ts:float=None) -> bytes:
+    if kind == KIND_STATUS and set(data) == {"id", "v", "t"} and all(type(data[k]) == int for k in data):
+        kind, payload = KIND_CELL, CELL.pack(data["id"], data["v"], data["t"])
+    elif kind == KIND_TRACE:
+        payload = data["s"] if type(data["s"]) == bytes else b""
+    else:
+        payload = json.dumps(data, separators=(",", ":"), default=str).encode("utf-8")
+    return RECORD_HEADER.pack(len(payload), time.time() if ts is None else ts, kind, target if target else 0) + payload
+
+
+def decode_payload(kind:int, payload) -> tuple:
+    # -> (kind as passed to the dongle handlers, data)
+    if kind == KIND_CELL:
+        cell, v, t = CELL.unpack(payload)
+        return KIND_STATUS, {"id": cell, "v": v, "t": t}
+    if kind == KIND_TRACE:
+        return KIND_TRACE, {"s": bytes(payload)}
+    return kind, json.loads(bytes(payload).decode("utf-8"))
+
+
+class CaptureWriter(threading.Thread):
+    FLUSH_INTERVAL = 1.0
+    BUFFER_SIZE = 256 * 1024
+
+    def __init__(self, path:str):
+        super().__init__(group=None, name="capture_writer", daemon=True)
+        self.path = path
+        self.error = None
+        self.records = 0
+        self.__records = queue.Queue()
+
+    def record(self, kind:int, target, data:dict):
+        # encoding is cheap, the disk write happens on the writer thread
+        self.__records.put(encode_record(kind, target, data))
+
+    def stop(self):
+        # the records queued so far are written first, the None comes after them
+        self.__records.put(None)
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        try:
+            new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            with open(self.path, "ab", buffering=self.BUFFER_SIZE) as f:
+                if new_file:
+                    f.write(MAGIC)
+                while True:
+                    try:
+                        record = self.__records.get(timeout=self.FLUSH_INTERVAL)
+                    except queue.Empty:
+                        f.flush()
+                        continue
+                    if record is None:
+                        break
+                    f.write(record)
+                    self.records += 1
+        except OSError as e:
+            self.error = e
+
+
+class CaptureReader:
+    def __init__(self, path:str):
+        self.path = path
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size <= len(MAGIC):
+                self.__map = b""
+                return
+            self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.__map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a BMS3 capture")
+
+    def __iter__(self):
+        # -> (timestamp, kind, target, data); a record cut off at the end of the file is ignored
+        view = memoryview(self.__map)
+        offset = len(MAGIC)
+        while offset + RECORD_HEADER.size <= len(view):
+            length, ts, kind, target = RECORD_HEADER.unpack_from(view, offset)
+            offset += RECORD_HEADER.size
+            if offset + length > len(view):
+                break
+            kind, data = decode_payload(kind, view[offset:offset + length])
+            offset += length
+            yield ts, kind, target if target else None, data
+
+    def targets(self) -> list:
+        # walks the record headers only, no payload is decoded: opening a long capture stays quick
+        found = {}
+        unpack = RECORD_HEADER.unpack_from
+        size = len(self.__map)
+        offset = len(MAGIC)
+        while offset + RECORD_HEADER.size <= size:
+            length, _, _, target = unpack(self.__map, offset)
+            offset += RECORD_HEADER.size + length
+            if offset > size:
+                break
+            # a dict keeps the order the targets were first seen in
+            found[target if target else None] = True
+        return list(found)
+
+    def close(self):
+        if type(self.__map) == mmap.mmap:
+            try:
+                self.__map.close()
+            except BufferError:
+                # a paused iteration still holds a view, the map goes away with it
+                pass
+
+
+class ReplayDevice:
+    def __init__(self, serial:int):
+        self.serial = serial
+        self.subnet_device = None
+
+
+class ReplaySource(DeviceSource):
+    # requests are not answered, the recorded answers are played back instead
+    POLLED = False
+
+    def __init__(self, path:str, speed:float=1.0):
+        self.speed = speed
+        self.reader = CaptureReader(path)
+        targets = self.reader.targets()
+        super().__init__(path, can_adapter=any(targets))
+        self.__devlist = [ReplayDevice(target) for target in targets if target]
+        self.finished = threading.Event()
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__replay, name="replay", daemon=True)
+
+    def get_devlist(self) -> list:
+        return self.__devlist if self.can_adapter else None
+
+    def start_threads(self):
+        self.__thread.start()
+
+    def stop_threads(self):
+        self.__stop.set()
+        if self.__thread.is_alive():
+            self.__thread.join()
+        self.reader.close()
+
+    def __replay(self):
+        started = None
+        for ts, kind, target, data in self.reader:
+            if self.__stop.is_set():
+                break
+            if started is None:
+                started, first = time.monotonic(), ts
+            if self.speed:
+                pause = started + (ts - first) / self.speed - time.monotonic()
+                if pause > 0 and self.__stop.wait(pause):
+                    break
+            if self.dongle:
+                self.dongle.on_device_event(kind, target, data)
+        self.finished.set()
@@ -0,0 +1,110 @@
+import numpy as np
+
+from asciimatics.widgets import Widget
+from asciimatics.event import KeyboardEvent
+from asciimatics.screen import Screen
+
+
+class CellGrid(Widget):
+    # The cell table: numbers, voltages and temperatures of any number of cells kept in flat arrays.
+    # Only the page that fits the width is drawn, a handful of paints per cell on screen whether the
+    # pack has 16 cells or 200. Left/Right and PgUp/PgDn turn the pages while it has the focus.
+    LABELS = ("CELL NUM:", "CELL V:", "CELL T:")
+    LABEL_WIDTH = 10
+    COLUMN_WIDTH = 6
+
+    def __init__(self, cells:int=16, name:str=None):
+        super().__init__(name, tab_stop=True)
+        self.page = 0
+        self.resize(cells)
+
+    def resize(self, cells:int):
+        # a new count starts the table over, the device will report every cell again
+        self.cells = cells
+        # voltages in mV and temperatures, NaN until the cell is reported
+        self.v = np.full(cells, np.nan)
+        self.t = np.full(cells, np.nan)
+        self.v_alarm = np.zeros(cells, dtype=bool)
+        self.t_alarm = np.zeros(cells, dtype=bool)
+        self.page = min(self.page, self.pages - 1)
+
+    def required_height(self, offset, width):
+        return len(self.LABELS)
+
+    def reset(self):
+        pass
+
+    @property
+    def value(self):
+        return None
+
+    @value.setter
+    def value(self, new_value):
+        pass
+
+    @property
+    def per_page(self) -> int:
+        width = self._w if self._w else self.LABEL_WIDTH + self.cells * self.COLUMN_WIDTH
+        return max((width - self.LABEL_WIDTH) // self.COLUMN_WIDTH, 1)
+
+    @property
+    def pages(self) -> int:
+        return max((self.cells + self.per_page - 1) // self.per_page, 1)
+
+    def set_cell(self, cell:int, v:float, t:float):
+        if 0 <= cell < self.cells:
+            self.v[cell] = v
+            self.t[cell] = t
+
+    def set_alarms(self, v_alarm:np.ndarray, t_alarm:np.ndarray):
+        count = min(len(v_alarm), self.cells)
+        self.v_alarm[:] = False
+        self.t_alarm[:] = False
+        self.v_alarm[:count] = v_alarm[:count]
+        self.t_alarm[:count] = t_alarm[:count]
+
+    def show_page(self, page:int):
+        self.page = min(max(page, 0), self.pages - 1)
+
+    def update(self, frame_no):
+        palette = self._frame.palette
+        canvas = self._frame.canvas
+        # keep the page on screen when the width changed
+        self.page = min(self.page, self.pages - 1)
+        first = self.page * self.per_page
+        last = min(first + self.per_page, self.cells)
+        labels = list(self.LABELS)
+        if self.pages > 1:
+            labels[0] = f"<{self.page + 1}/{self.pages}>"
+        fg, attr, bg = palette["label"]
+        for i, label in enumerate(labels):
+            canvas.paint(label.ljust(self.LABEL_WIDTH), self._x, self._y + i, fg, attr, bg)
+        x = self._x + self.LABEL_WIDTH
+        fg, attr, bg = palette["selected_focus_field" if self._has_focus else "field"]
+        canvas.paint("".join(f"{cell + 1:<{self.COLUMN_WIDTH}}" for cell in range(first, last)).ljust(self._w - self.LABEL_WIDTH),
+                     x, self._y, fg, attr, bg)
+        for row, values, alarms, fmt in ((1, self.v, self.v_alarm, lambda v: "%.3f" % (v / 1000)),
+                                         (2, self.t, self.t_alarm, lambda t: "%d" % t)):
+            for column, cell in enumerate(range(first, last)):
+                text = "--" if np.isnan(values[cell]) else fmt(values[cell])
+                fg, attr, bg = palette["invalid" if alarms[cell] else "field"]
+                canvas.paint(text.ljust(self.COLUMN_WIDTH), x + column * self.COLUMN_WIDTH, self._y + row, fg, attr, bg)
+            fg, attr, bg = palette["field"]
+            rest = self._w - self.LABEL_WIDTH - (last - first) * self.COLUMN_WIDTH
+            if rest > 0:
+                canvas.paint(" " * rest, x + (last - first) * self.COLUMN_WIDTH, self._y + row, fg, attr, bg)
+
+    def process_event(self, event):
+        if isinstance(event, KeyboardEvent):
+            if event.key_code in (Screen.KEY_LEFT, Screen.KEY_PAGE_UP):
+                self.show_page(self.page - 1)
+            elif event.key_code in (Screen.KEY_RIGHT, Screen.KEY_PAGE_DOWN):
+                self.show_page(self.page + 1)
+            elif event.key_code == Screen.KEY_HOME:
+                self.show_page(0)
+            elif event.key_code == Screen.KEY_END:
+                self.show_page(self.pages - 1)
+            else:
+                return event
+            return None
+        return event
@@ -0,0 +1,1229 @@
+import threading
+import os, re, time, functools
+from typing import NamedTuple
+
+from asciimatics.widgets import Frame, Layout, Label, Divider, Text, Button, PopUpDialog, MultiColumnListBox, Widget
+from asciimatics.scene import Scene
+from asciimatics.screen import Screen
+from asciimatics.exceptions import ResizeScreenError, NextScene
+
+from bms3_base.bms3_dongle import BMS3Client
+from bms3_base.params import get_bitflags
+import emulib.tools.emulib_debug_print as my_print
+from emulib.tools.emulib_console_helper import DEFAULT_UART_SPEED
+
+from trace_log import TraceLog, TraceWriter, TraceDecoder, default_trace_path
+from telemetry_log import TelemetryWriter
+from trace_view import TraceView
+from cell_grid import CellGrid
+from render import RedrawScheduler, resize_screen
+from scheduler import CommandQueue, PollScheduler, PollTask, InFlightWindow
+from sources import PendingSource, SourceOpener
+from telemetry import CellHistory
+from alarms import AlarmEngine, OV, UV, OT, IMBALANCE
+from capture import CaptureWriter, ReplaySource, KIND_STATUS, KIND_INFO, KIND_TRACE
+from simulator import SimulatedSource
+from metrics import Metrics, MetricsReporter
+from engine import AsyncEngine
+from publisher import Publisher, SubscriberSource
+from shared_state import SharedState, SharedRing, StatePublisher, RemoteDongle
+
+if os.name == "posix":
+    my_print.DO_PRINT = False
+    my_print.DO_DEBUG_PRINT = False
+    my_print.DO_ERROR_PRINT = False
+
+
+class ExitFromApp(Exception):
+    pass
+
+class DecodedFlags(NamedTuple):
+    flags: int
+    names: tuple
+    values: tuple
+    summary: str
+
+
+@functools.lru_cache(maxsize=64)
+def decode_flags(flags:int) -> DecodedFlags:
+    # the flag word rarely changes, so both frames share one decode per distinct value
+    bf = get_bitflags(flags)
+    summary = str(bf.flags)
+    for k, v in bf.items():
+        if v:
+            summary += f" | {k}"
+    return DecodedFlags(flags, tuple(bf.keys()), tuple(bf.values()), summary)
+
+
+def post_update(callbacks:dict, key, fn, *args):
+    # device threads don't touch the widgets: with an update channel the change runs on the UI
+    # thread at the next render tick, and only the latest one per key
+    if "post_update" in callbacks:
+        callbacks["post_update"](key, fn, *args)
+    else:
+        fn(*args)
+
+
+class FlagFrame(Frame):
+    FLAGS_NUMBER_IN_ROW = 8
+    def __init__(self, screen, callbacks):
+        super(FlagFrame, self).__init__(screen,
+                                        int(screen.height),
+                                        int(screen.width),
+                                        data=None,
+                                        has_shadow=True,
+                                        name="FlagDescription")
+        self.callbacks = callbacks
+        self.__values = None
+        layout = Layout([1] * 2, False)
+        self.add_layout(layout)
+        bf = get_bitflags()
+        for i in range(len(bf)):
+            flag = Text(label=str(bf[i] + ":"), name=f"flag{i}", readonly=True, disabled=True, max_length=20)
+            flag.custom_colour = "field"
+            layout.add_widget(flag, column=int(i/16))
+
+        layout = Layout([1])
+        self.add_layout(layout)
+        layout.add_widget(Divider())
+        layout.add_widget(Button("Return to main screen", self._return), 0)
+        self.fix()
+        self._build_index()
+        # handlers are called from the device threads, register them only once the widgets exist
+        self.callbacks.update({"on_flag_handler": self.on_flag_handler})
+
+    def _build_index(self):
+        self.flag_widgets = [self.find_widget(f"flag{i}") for i in range(len(get_bitflags()))]
+
+    def reset(self):
+        super().reset()
+        self._build_index()
+        self.__values = None
+
+    def _return(self):
+        raise NextScene("Main")
+
+    def _mark_dirty(self, name=None):
+        if "mark_dirty" in self.callbacks:
+            self.callbacks["mark_dirty"](name)
+
+    def on_flag_handler(self, data):
+        if "flags" in data:
+            post_update(self.callbacks, "flags", self._show_flags, data)
+
+    def _show_flags(self, data):
+        if "flags" in data:
+            decoded = decode_flags(data["flags"])
+            if decoded.values == self.__values:
+                return
+            first = self.__values is None
+            for i, (f, value) in enumerate(zip(self.flag_widgets, decoded.values)):
+                if not f:
+                    continue
+                changed = first or value != self.__values[i]
+                if changed:
+                    f.value = str(value)
+                # highlight the bits that flipped with the last change of the flag word
+                f.custom_colour = "selected_field" if changed and not first else "field"
+            self.__values = decoded.values
+            self._mark_dirty("flags")
+
+
+
+class DeviceListFrame(Frame):
+    COLUMNS = ["<3", "<12", "<12", "<10", ">8", ">8", ">6", ">8", ">6", ">9"]
+    TITLES = ["", "BMS ID", "BAL ID", "NAME", "V MIN", "V MAX", "T MAX", "CURR", "SOC", "TIMEOUTS"]
+
+    def __init__(self, screen, callbacks):
+        super(DeviceListFrame, self).__init__(screen,
+                                        int(screen.height),
+                                        int(screen.width),
+                                        data=None,
+                                        has_shadow=True,
+                                        name="DeviceList")
+        self.callbacks = callbacks
+        layout = Layout([1], fill_frame=True)
+        self.add_layout(layout)
+        self.devices_box = MultiColumnListBox(Widget.FILL_FRAME, self.COLUMNS, [], titles=self.TITLES,
+                                              name="devices_box", add_scroll_bar=True, on_select=self._select)
+        layout.add_widget(self.devices_box)
+
+        layout = Layout([1])
+        self.add_layout(layout)
+        layout.add_widget(Divider())
+        layout.add_widget(Button("Return to main screen", self._return), 0)
+        self.fix()
+        self.callbacks.update({"on_devices_handler": self.on_devices_handler})
+        if "get_devices_overview" in self.callbacks:
+            self.on_devices_handler(self.callbacks["get_devices_overview"]())
+
+    def _return(self):
+        raise NextScene("Main")
+
+    def _select(self):
+        if "select_device" in self.callbacks:
+            self.callbacks["select_device"](self.devices_box.value)
+        raise NextScene("Main")
+
+    def on_devices_handler(self, devices:list):
+        post_update(self.callbacks, "devices_box", self._show_devices, devices)
+
+    def _show_devices(self, devices:list):
+        def fmt(value, pattern):
+            return "--" if value is None else pattern % value
+        options = []
+        for device in devices:
+            row = ["*" if device["selected"] else "",
+                   fmt(device["bms_id"], "0x%x"), fmt(device["bal_id"], "0x%x"), fmt(device["name"], "%s"),
+                   fmt(device["v_min"], "%.3f"), fmt(device["v_max"], "%.3f"), fmt(device["t_max"], "%d"),
+                   fmt(device["curr"], "%d"), fmt(device["soc"], "%d"), str(device["timeouts"])]
+            options.append((row, device["target"]))
+        self.devices_box.options = options
+        if "mark_dirty" in self.callbacks:
+            self.callbacks["mark_dirty"]("devices_box")
+
+
+class BmsToolFrame(Frame):
+    MAX_CRITICAL_TIMEOUTS_NUMBER = 3
+    INDEXED_WIDGETS = ("bms_info_lbl", "bal_info_lbl", "bms_id_lbl", "bal_id_lbl", "flags_lbl", "common_lbl",
+                       "traces_box", "search", "follow_btn", "source_btn", "path", "port_info_lbl", "latency_lbl",
+                       "pack_lbl", "alarms_lbl", "metrics_lbl", "cells_grid")
+    LATENCY_TYPES = ("status", "status id", "info", "infobal", "trace")
+
+    def __init__(self, screen, callbacks, init_data):
+        super(BmsToolFrame, self).__init__(screen,
+                                        int(screen.height),
+                                        int(screen.width),
+                                        data=init_data,
+                                        has_shadow=True,
+                                        name="Bms3ToolConsole")
+        # kept up to date, a reset on resize or scene change starts from it again
+        self.init_data = init_data
+        self.callbacks = callbacks
+        self.layout = Layout([1] * 2)
+        self.add_layout(self.layout)
+        bms_info = Text(label="BMS INFO:", name="bms_info_lbl", readonly=False, disabled=True)
+        bms_info.custom_colour = "field"
+        bal_info = Text(label="BAL INFO:", name="bal_info_lbl", readonly=False, disabled=True)
+        bal_info.custom_colour = "field"
+        bmsid = Text(label="BMS ID:", name="bms_id_lbl", readonly=False, disabled=True)
+        bmsid.value = "-- "
+        bmsid.custom_colour = "field"
+        balid = Text(label="BAL ID:", name="bal_id_lbl", readonly=False, disabled=True)
+        balid.value = " -- "
+        balid.custom_colour = "field"
+        self.layout.add_widget(bms_info, 0)
+        self.layout.add_widget(bal_info, 0)
+        self.layout.add_widget(bmsid, 1)
+        self.layout.add_widget(balid, 1)
+
+        self.layout = Layout([1], fill_frame=False)
+        self.add_layout(self.layout)
+        cells = self.callbacks["get_cells"]() if "get_cells" in self.callbacks else ConsoleDongle.DEFAULT_CELLS
+        self.layout.add_widget(CellGrid(cells, name="cells_grid"), 0)
+
+        self.layout = Layout([1])
+        self.add_layout(self.layout)
+        self.layout.add_widget(Divider(height=1), 0)
+        flags = Text(label="FLAGS:", name="flags_lbl", readonly=False, disabled=True)
+        flags.custom_colour = "field"
+        common = Text(label="COMMON:", name="common_lbl", readonly=False, disabled=True)
+        common.custom_colour = "field"
+        pack = Text(label="PACK:", name="pack_lbl", readonly=False, disabled=True)
+        pack.custom_colour = "field"
+        alarms = Text(label="ALARMS:", name="alarms_lbl", readonly=False, disabled=True)
+        alarms.custom_colour = "field"
+        self.layout.add_widget(flags)
+        self.layout.add_widget(common)
+        self.layout.add_widget(pack)
+        self.layout.add_widget(alarms)
+
+        self.layout = Layout([1] * 2)
+        self.add_layout(self.layout)
+        flags.custom_colour = "field"
+        self.layout.add_widget(Button("Flag verbose", self._to_flag_description, add_box=True), 0)
+        self.layout.add_widget(Button("Devices", self._to_devices, add_box=True), 1)
+
+        self.layout_trace = Layout([1], fill_frame=False)
+        self.add_layout(self.layout_trace)
+        self.layout_trace.add_widget(Divider(height=1), 0)
+        self.layout = Layout([4, 1, 1, 1, 1])
+        self.add_layout(self.layout)
+        self.layout.add_widget(Text(label="SEARCH:", name="search", on_change=self._search, validator=self._valid_pattern), 0)
+        self.layout.add_widget(Button("Prev", lambda: self._find(True)), 1)
+        self.layout.add_widget(Button("Next", lambda: self._find(False)), 2)
+        self.layout.add_widget(Button("Pause", self._toggle_follow, name="follow_btn"), 3)
+        self.layout.add_widget(Button("Source: ALL", self._next_source, name="source_btn"), 4)
+        self.layout = Layout([1], fill_frame=False)
+        self.add_layout(self.layout)
+        store = self.callbacks["get_trace_store"]() if "get_trace_store" in self.callbacks else TraceLog()
+        self.layout.add_widget(TraceView(height=10, store=store, name="traces_box", on_change=self._show_trace_state))
+
+        self.layout = Layout([1])
+        self.add_layout(self.layout)
+        self.layout.add_widget(Divider(height=1), 0)
+        path = Text(name="path", readonly=False, disabled=False, label="PATH TO TRACE FILE:")
+        if "get_trace_path" in self.callbacks:
+            path.value = self.callbacks["get_trace_path"]()
+        else:
+            path.value = default_trace_path()
+        self.layout.add_widget(path, 0)
+        self.layout.add_widget(Divider(height=1), 0)
+
+        self.layout = Layout([1]*3)
+        self.add_layout(self.layout)
+        self.layout.add_widget(Button("Save trace", self._save_trace), 0)
+        self.layout.add_widget(Button("Clear trace", self._clear_trace), 0)
+
+        self.layout.add_widget(Button("Trace: ON", lambda: self.callbacks["trace_ctrl"](True)),       1)
+        self.layout.add_widget(Button("Trace: OFF", lambda: self.callbacks["trace_ctrl"](False)),     1)
+
+        self.layout.add_widget(Button("Trace BAL: ON", lambda: self.callbacks["bal_trace_ctrl"](True)),   2)
+        self.layout.add_widget(Button("Trace BAL: OFF",lambda: self.callbacks["bal_trace_ctrl"](False)),  2)
+
+        self.layout = Layout([1] * 2)
+        self.add_layout(self.layout)
+        self.layout.add_widget(Divider(height=1), 0)
+        self.layout.add_widget(Divider(height=1), 1)
+        self.layout.add_widget(Label(label=f"PORT: | CAN ADAPTER: ", name="port_info_lbl"))
+        self.layout.add_widget(Label(label="LATENCY p50/p99 ms: --", name="latency_lbl"))
+        self.layout.add_widget(Label(label="Q: -- | REQ/RSP: --/s | TO: -- | TRACE: -- | HND/RND: -- ms", name="metrics_lbl"), 1)
+        self.layout.add_widget(Button("Quit", self._quit), 1)
+
+        self.fix()
+        self._build_index()
+        # handlers are called from the device threads, register them only once the widgets exist
+        self.callbacks.update(
+            {
+                "on_info_handler": self.on_info_handler,
+                "on_status_handler": self.on_status_handler,
+                "on_trace_handler": self.on_trace_handler,
+                "on_timeout_handler": self.on_timeout_handler,
+                "on_latency_handler": self.on_latency_handler,
+                "on_metrics_handler": self.on_metrics_handler,
+                "on_pack_stats_handler": self.on_pack_stats_handler,
+                "on_alarm_handler": self.on_alarm_handler,
+                "on_cells_handler": self.on_cells_handler,
+                "on_get_dongle_info_handler": self.on_get_dongle_info_handler,
+                "on_port_disconnect": self.on_port_disconnect,
+                "on_no_device_found": self.on_no_device_found,
+                "on_connect_failed": self.on_connect_failed
+            })
+        if "update_port_info" in self.callbacks:
+            self.callbacks["update_port_info"]()
+
+    def _build_index(self):
+        # direct references to the data widgets, so handlers don't walk the layouts
+        self.widgets = {name: self.find_widget(name) for name in self.INDEXED_WIDGETS}
+
+    def reset(self):
+        super().reset()
+        self._build_index()
+
+    def on_get_dongle_info_handler(self, portname:str, canadapter:bool, bms_id:int, bal_id:int, state:str="connected"):
+        post_update(self.callbacks, "port_info_lbl", self._show_dongle_info, portname, canadapter, bms_id, bal_id, state)
+
+    def _show_dongle_info(self, portname:str, canadapter:bool, bms_id:int, bal_id:int, state:str="connected"):
+        self.widgets["port_info_lbl"].text = f"PORT: {portname} | CAN ADAPTER: {canadapter}" + \
+            ("" if state == "connected" else f" | {state.upper()}")
+        self.widgets["bms_id_lbl"].value = "0x%x" % bms_id
+        self.widgets["bal_id_lbl"].value = "0x%x" % bal_id
+        self._mark_dirty("port_info_lbl")
+
+    def on_info_handler(self, data):
+        post_update(self.callbacks, ("info", data.get("name")), self._show_info, data)
+
+    def _show_info(self, data):
+        device_name = data["name"] if "name" in data else None
+        hardware_version = data["hwver"] if "hwver" in data else None
+        firmware_version = data["fwver"] if "fwver" in data else None
+        tlbl = self.widgets["bms_info_lbl"]
+        if data["name"] == "BAL3" and tlbl:
+            tlbl = self.widgets["bal_info_lbl"]
+        if tlbl:
+            tlbl.value = str(f"Name: {device_name} FW: {firmware_version} HW: {hardware_version}")
+            self._mark_dirty(tlbl.name)
+
+    def on_status_handler(self, data):
+        post_update(self.callbacks, ("cell", data["id"]) if "id" in data else "status", self._show_status, data)
+
+    def _show_status(self, data):
+        if self.data["first_run"]:
+            self.data["first_run"] = False
+            self.init_data["first_run"] = False
+            if "trace_ctrl" in self.callbacks and "bal_trace_ctrl" in self.callbacks:
+                self.callbacks["trace_ctrl"](True)
+                self.callbacks["bal_trace_ctrl"](True)
+        if "id" in data:
+            self.widgets["cells_grid"].set_cell(data["id"], data["v"], data["t"])
+            self._mark_dirty("cells_grid")
+        elif "flags" in data:
+            flag_lbl = self.widgets["flags_lbl"]
+            if flag_lbl:
+                flag_lbl.value = decode_flags(data["flags"]).summary
+            common = self.widgets["common_lbl"]
+            if common:
+                status = ""
+                for k, v in data.items():
+                    if k != "flags" and k != "qty" and "v" in k or "curr" == k or "soc" == k:
+                        mod = 1
+                        if "v" in k:
+                            mod = 1000
+                        status += f"{k}: {v/mod if mod == 1000 else int(v/mod)} | "
+                common.value = status
+            self._mark_dirty("flags_lbl")
+
+    def on_pack_stats_handler(self, stats:dict):
+        if stats is not None:
+            post_update(self.callbacks, "pack_lbl", self._show_pack_stats, stats)
+
+    def _show_pack_stats(self, stats:dict):
+        pack = f"min: {stats['v_min']:.3f} ({stats['v_min_cell'] + 1}) | max: {stats['v_max']:.3f} ({stats['v_max_cell'] + 1}) | " \
+               f"mean: {stats['v_mean']:.3f} | imbalance: {stats['imbalance'] * 1000:.0f} mV"
+        if stats["drift_cell"] is not None:
+            pack += f" | dV/dt: cell {stats['drift_cell'] + 1} {stats['drift']:+.2f} mV/s"
+        self.widgets["pack_lbl"].value = pack
+        self._mark_dirty("pack_lbl")
+
+    def on_alarm_handler(self, active, summary:str, last:str):
+        post_update(self.callbacks, "alarms_lbl", self._show_alarms, active, summary, last)
+
+    def _show_alarms(self, active, summary:str, last:str):
+        self.widgets["cells_grid"].set_alarms(active[[OV, UV, IMBALANCE]].any(axis=0), active[OT])
+        alarms = self.widgets["alarms_lbl"]
+        alarms.value = (summary if summary else "--") + (f" | last: {last}" if last else "")
+        alarms.custom_colour = "invalid" if summary else "field"
+        self._mark_dirty()
+
+    def on_cells_handler(self, cells:int):
+        post_update(self.callbacks, "cells_grid", self._show_cells, cells)
+
+    def _show_cells(self, cells:int):
+        grid = self.widgets["cells_grid"]
+        if cells != grid.cells:
+            grid.resize(cells)
+            self._mark_dirty("cells_grid")
+
+    def on_trace_handler(self, trace:str):
+        # the view reads the store itself, new lines only matter while it follows the end
+        if self.widgets["traces_box"].follow:
+            post_update(self.callbacks, "traces_box", self._mark_dirty, "traces_box")
+
+    @staticmethod
+    def _valid_pattern(text:str) -> bool:
+        try:
+            re.compile(text)
+            return True
+        except re.error:
+            return False
+
+    def _search(self):
+        self.widgets["traces_box"].search(self.widgets["search"].value)
+
+    def _find(self, backward:bool):
+        self.widgets["traces_box"].find(backward)
+
+    def _toggle_follow(self):
+        traces = self.widgets["traces_box"]
+        traces.set_follow(not traces.follow)
+
+    def _next_source(self):
+        sources = (None,) + TraceLog.SOURCES
+        traces = self.widgets["traces_box"]
+        traces.set_source(sources[(sources.index(traces.source) + 1) % len(sources)])
+
+    def _show_trace_state(self):
+        traces = self.widgets["traces_box"]
+        self.widgets["follow_btn"].text = "Pause" if traces.follow else "Follow"
+        self.widgets["source_btn"].text = f"Source: {traces.source or 'ALL'}"
+        self._mark_dirty("traces_box")
+
+    def on_timeout_handler(self, timeouts):
+        if timeouts > self.MAX_CRITICAL_TIMEOUTS_NUMBER:
+            post_update(self.callbacks, "timeout_popup", self._popup,
+                        f"Critical number of timeout error: {timeouts}. Exit from program")
+
+    def on_latency_handler(self, stats:dict):
+        post_update(self.callbacks, "latency_lbl", self._show_latency, stats)
+
+    def _show_latency(self, stats:dict):
+        latency = ""
+        for kind in self.LATENCY_TYPES:
+            if kind in stats and stats[kind]["count"]:
+                latency += f" {kind}: {stats[kind]['p50'] * 1000:.0f}/{stats[kind]['p99'] * 1000:.0f} |"
+        self.widgets["latency_lbl"].text = "LATENCY p50/p99 ms:" + (latency if latency else " --")
+        self._mark_dirty("latency_lbl")
+
+    def on_metrics_handler(self, metrics:dict):
+        post_update(self.callbacks, "metrics_lbl", self._show_metrics, metrics)
+
+    def _show_metrics(self, metrics:dict):
+        rates = metrics["rates"]
+        means = metrics["means"]
+        def ms(name):
+            return f"{means[name] * 1000:.2f}" if means.get(name) is not None else "--"
+        self.widgets["metrics_lbl"].text = f"Q: {metrics['gauges'].get('queue_depth', 0)} | " \
+            f"REQ/RSP: {rates.get('requests', 0):.0f}/{rates.get('responses', 0):.0f}/s | " \
+            f"TO: {metrics['counters'].get('timeouts', 0)} | TRACE: {rates.get('trace_bytes', 0) / 1024:.1f} kB/s | " \
+            f"HND/RND: {ms('handler')}/{ms('render')} ms"
+        if metrics["gauges"].get("state_dropped"):
+            # --split: updates too large for their shared memory slot never reached this screen
+            self.widgets["metrics_lbl"].text += f" | DROP: {metrics['gauges']['state_dropped']}"
+        self._mark_dirty("metrics_lbl")
+
+    def get_traces(self) -> str:
+        if "get_trace_log" in self.callbacks:
+            return self.callbacks["get_trace_log"]()
+        return self.widgets["traces_box"].store.text()
+
+    def _save_trace(self):
+        path = self.widgets["path"]
+        info_msg = "Trace saved: %s" % path.value
+        theme = "green"
+        if "save_trace" in self.callbacks:
+            saved = self.callbacks["save_trace"](path.value)
+        else:
+            try:
+                with open(path.value, "w") as f:
+                    f.write(self.get_traces())
+                saved = True
+            except:
+                saved = False
+        if not saved:
+            info_msg = "Trace NOT saved: %s" % path.value
+            theme = "warrning"
+        self._scene.add_effect(PopUpDialog(self._screen, info_msg, ["OK"], theme=theme))
+
+    def _clear_trace(self):
+        self._scene.add_effect(
+                PopUpDialog(self._screen,
+                            "Clear trace",
+                            ["Yes", "No"],
+                            on_close=self._clear_on_yes)
+        )
+
+    def _clear_on_yes(self, selected):
+        if selected == 0:
+            traces = self.widgets["traces_box"]
+            if traces:
+                if "on_clear_log" in self.callbacks:
+                    self.callbacks["on_clear_log"]()
+                else:
+                    traces.store.clear()
+                traces.match = None
+                traces.set_follow(True)
+                self.save()
+
+    def _quit(self):
+        self._scene.add_effect(
+                PopUpDialog(self._screen,
+                            "Are you sure?",
+                            ["Yes", "No"],
+                            on_close=self._quit_on_yes)
+        )
+
+    def _quit_on_yes(self, selected):
+        # Yes is the first button
+        if selected == 0:
+            raise ExitFromApp("exit")
+
+    def _to_flag_description(self):
+        raise NextScene("FlagTable")
+
+    def _to_devices(self):
+        raise NextScene("Devices")
+
+    def on_port_disconnect(self):
+        post_update(self.callbacks, "disconnect_popup", self._popup, "Port is disconnect. Exit from program")
+
+    def on_no_device_found(self):
+        post_update(self.callbacks, "no_device_popup", self._popup, "No device found on CAN bus. Exit from program")
+
+    def on_connect_failed(self, error:str):
+        post_update(self.callbacks, "connect_popup", self._popup, f"Couldn't connect: {error}. Exit from program")
+
+    def _popup(self, message:str):
+        self._scene.add_effect(PopUpDialog(self._screen, message, ["OK"], on_close=self._quit_on_yes))
+        self._mark_dirty()
+
+    def _mark_dirty(self, name=None):
+        if "mark_dirty" in self.callbacks:
+            self.callbacks["mark_dirty"](name)
+
+class DeviceState:
+    def __init__(self, dev=None, cells:int=16):
+        self.dev = dev
+        self.serial = dev.serial if dev else 0
+        self.bal_serial = dev.subnet_device.serial if dev and dev.subnet_device else 0
+        # latest decoded frames, replayed into the main frame when the device gets selected
+        self.cells = {}
+        self.status = {}
+        self.info = {}
+        self.timeouts = 0
+        # cells came in since the pack stats were last worked out
+        self.stats_pending = False
+        self.resize(cells)
+
+    def resize(self, cells:int):
+        # cells polled and kept for the device, the history starts over with the new count
+        self.cell_count = cells
+        self.history = CellHistory(cells)
+        for cell in [cell for cell in self.cells if cell >= cells]:
+            del self.cells[cell]
+
+    def overview(self) -> dict:
+        voltages = [c["v"] for c in self.cells.values() if "v" in c]
+        temperatures = [c["t"] for c in self.cells.values() if "t" in c]
+        return {
+            "bms_id": self.serial,
+            "bal_id": self.bal_serial,
+            "name": next((name for name in self.info if name != "BAL3"), None),
+            "v_min": min(voltages) / 1000 if voltages else None,
+            "v_max": max(voltages) / 1000 if voltages else None,
+            "t_max": max(temperatures) if temperatures else None,
+            "curr": self.status.get("curr"),
+            "soc": self.status.get("soc"),
+            "timeouts": self.timeouts,
+        }
+
+
+class Bms3Source(BMS3Client):
+    # DeviceSource over a real port, BMS3Client already provides most of the interface
+    POLLED = True
+
+    def __init__(self, serial_port, can_adapter=False):
+        self.can_adapter = can_adapter
+        self.dongle = None
+        super().__init__(serial_port, DEFAULT_UART_SPEED, rtscts=False, can_adapter=can_adapter, key=None)
+        if self._adapter.device_port is None:
+            my_print.error_print(f"Port: {serial_port} is busy or wrong")
+            return
+        if can_adapter:
+            self.enumeration(False)
+            if self.get_devlist() == []:
+                my_print.error_print(f"Devices on port: {serial_port} not found")
+                return
+
+    def is_open(self):
+        return self._adapter.device_port
+
+    def send_data_to_port(self, data, channel=None, flags=None):
+        if self._adapter.device_port:
+            return super().send_data_to_port(data, channel=channel, flags=flags)
+        return 0
+
+    def get_device_info_handler(self, data):
+        if self.dongle:
+            self.dongle.get_device_info_handler(data)
+
+    def get_device_status_handler(self, data):
+        if self.dongle:
+            self.dongle.get_device_status_handler(data)
+
+    def get_trace_handler(self, data):
+        if self.dongle:
+            self.dongle.get_trace_handler(data)
+
+
+class ConsoleDongle:
+    SENDER_IDLE_TIMEOUT = 0.1
+    DEFAULT_CELLS = 16
+    MAX_CELLS = 256
+    # consecutive timeouts after which a device only gets a status probe until it answers again
+    OFFLINE_TIMEOUTS = 3
+    DEFAULT_POLL_HZ = PollScheduler.DEFAULT_POLL_HZ
+    INFO_PERIOD = 1.0
+    DEFAULT_INFO_BACKOFF_PERIOD = PollScheduler.DEFAULT_INFO_BACKOFF_PERIOD
+    LATENCY_REPORT_PERIOD = 1.0
+    OVERVIEW_REPORT_PERIOD = 1.0
+
+    def __init__(self, source, callbacks:dict={}, trace_log:TraceLog=None,
+                 trace_writer:TraceWriter=None, poll_hz:float=DEFAULT_POLL_HZ,
+                 info_backoff_period:float=DEFAULT_INFO_BACKOFF_PERIOD, window:int=InFlightWindow.DEFAULT_SIZE,
+                 capture:CaptureWriter=None, metrics_reporter:MetricsReporter=None, engine:str="threads",
+                 telemetry:TelemetryWriter=None, alarms:AlarmEngine=None, publisher:Publisher=None,
+                 cells:int=None):
+        # source of the device traffic: Bms3Source on a real port, ReplaySource for a capture file,
+        # SubscriberSource for the publisher of another instance, SimulatedSource for load tests,
+        # PendingSource until connect() has opened one of them
+        self.source = source
+        self.source.dongle = self
+        self.serial_port = source.serial_port
+        self.can_adapter = source.can_adapter
+        self.connect_error = None
+        self.__stopped = False
+        self.capture = capture
+        # decoded traffic goes to the capture file and the subscribers of the publisher alike
+        self.publisher = publisher
+        self.telemetry = telemetry
+        self.alarms = alarms
+        # cells polled per device: fixed from the command line, or None to follow the count the device reports
+        self.cells = cells
+        self.trace_log = trace_log if trace_log is not None else TraceLog()
+        self.trace_writer = trace_writer
+        self.trace_decoder = TraceDecoder()
+        # with batch_trace the UI hears about new trace once per render tick, from poll()
+        self.batch_trace = False
+        self.__trace_pending = []
+        self.__trace_lock = threading.Lock()
+        # the reporter samples the metrics once a period for the status line and the export file
+        self.metrics_reporter = metrics_reporter
+        self.metrics = metrics_reporter.metrics if metrics_reporter else Metrics()
+        if metrics_reporter:
+            metrics_reporter.on_report = self.__on_metrics
+        self.timeouts = 0
+        self.callbacks = {
+            "on_clear_log": self.__on_clear_log,
+            "trace_ctrl": self.trace_ctrl,
+            "bal_trace_ctrl": self.bal_trace_ctrl,
+            "update_port_info": self.update_port_info,
+            "get_trace_log": self.get_trace_log,
+            "get_trace_store": self.get_trace_store,
+            "get_trace_path": self.get_trace_path,
+            "save_trace": self.save_trace,
+            "select_device": self.select_device,
+            "get_devices_overview": self.get_devices_overview,
+            "get_cells": self.get_cells
+        }
+
+        self.callbacks.update(callbacks)
+        # one sender per in-flight slot, each of them has at most one request outstanding
+        self.window = InFlightWindow(window)
+        self.__latency_reported = 0.0
+        self.__overview_reported = 0.0
+        self.poll_hz = poll_hz
+        self.info_backoff_period = info_backoff_period
+        # DeviceState by serial, a single device without CAN adapter is kept under None
+        self.devices = {}
+        self.selected = None
+        if engine == "asyncio":
+            # poll timers and senders as coroutines on one event loop instead of a thread each
+            self.engine = AsyncEngine(self, window)
+            self.msgq = self.engine.msgq
+            self.poller = self.engine.poller
+            self._senders = []
+        else:
+            self.engine = None
+            self.msgq = CommandQueue()
+            self.poller = PollScheduler(self.msgq)
+            self._senders = [threading.Thread(target=self.__sender, name=f"__sender{i}", daemon=True) for i in range(window)]
+        self.metrics.gauge_fn("queue_depth", self.msgq.qsize)
+        if publisher:
+            self.metrics.gauge_fn("subscribers", lambda: publisher.subscribers)
+            self.metrics.gauge_fn("publish_dropped", lambda: publisher.dropped)
+
+    def is_open(self):
+        return self.source.is_open()
+
+    def get_devlist(self):
+        return self.source.get_devlist()
+
+    def start(self):
+        if self.trace_writer:
+            self.trace_writer.start()
+        if self.capture:
+            self.capture.start()
+        if self.publisher:
+            self.publisher.start()
+        if self.telemetry:
+            self.telemetry.start()
+        if self.alarms:
+            self.alarms.start()
+        if self.metrics_reporter:
+            self.metrics_reporter.start()
+        if self.is_open():
+            self.__start_source()
+
+    def connect(self, open_source, deadline:float=SourceOpener.DEFAULT_DEADLINE):
+        # opens the source in the background, the UI is up and shows "connecting" meanwhile
+        SourceOpener(open_source, deadline, on_open=self.attach, on_error=self.__on_connect_error).start()
+
+    def attach(self, source):
+        if self.__stopped:
+            source.stop_threads()
+            return
+        self.source = source
+        self.source.dongle = self
+        self.serial_port = source.serial_port
+        self.can_adapter = source.can_adapter
+        self.__start_source()
+        self.update_port_info()
+
+    def __start_source(self):
+        self.update_devices()
+        self.source.start_threads()
+        for sender in self._senders:
+            sender.start()
+        if self.engine:
+            self.engine.start()
+        elif self.source.POLLED:
+            self.poller.start()
+
+    def __on_connect_error(self, error:str):
+        self.connect_error = error
+        self.update_port_info()
+
+    def update_devices(self):
+        devlist = self.get_devlist() if self.can_adapter else None
+        targets = [dev.serial for dev in devlist if dev] if devlist else [None]
+        for target in list(self.devices):
+            if target not in targets:
+                self.poller.remove("info", target)
+                self.poller.remove("status", target)
+                if self.alarms:
+                    self.alarms.forget(self.devices[target].serial)
+                del self.devices[target]
+        for i, dev in enumerate(devlist if devlist else [None]):
+            target = dev.serial if dev else None
+            if dev is None and devlist or target in self.devices:
+                continue
+            self.devices[target] = DeviceState(dev, self.cells if self.cells else self.DEFAULT_CELLS)
+            # spread the cycles of the devices over one poll period
+            offset = i / len(targets) / self.poll_hz
+            self.poller.add(PollTask("info", functools.partial(self.__info_commands, target), self.INFO_PERIOD,
+                                     backoff_period=self.info_backoff_period, target=target), offset)
+            self.poller.add(PollTask("status", functools.partial(self.__status_commands, target), 1.0 / self.poll_hz,
+                                     adaptive=True, target=target), offset)
+        if self.selected not in self.devices:
+            self.selected = targets[0]
+
+    def select_device(self, target):
+        if target not in self.devices:
+            return
+        self.selected = target
+        device = self.devices[target]
+        self.update_port_info()
+        # the table takes the cell count first, a resize clears it
+        self.__forward_cells(device)
+        for data in device.info.values():
+            self.__forward_info(data)
+        for data in device.cells.values():
+            self.__forward_status(data)
+        if device.status:
+            self.__forward_status(device.status)
+        self.__forward_pack_stats(device)
+        self.__forward_alarms(device)
+
+    def get_devices_overview(self) -> list:
+        return [dict(device.overview(), target=target, selected=target == self.selected) for target, device in list(self.devices.items())]
+
+    def send_command(self, command, target=None):
+        # on a CAN adapter the channel selects the node the request is addressed to
+        return self.source.send_data_to_port(command, channel=target)
+
+    def stop_threads(self):
+        self.__stopped = True
+        if self.engine:
+            self.engine.stop()
+        self.poller.stop()
+        for sender in self._senders:
+            sender.do_run = False
+        self.msgq.close()
+        try:
+            for sender in self._senders:
+                sender.join()
+        except:
+            my_print.debug_print("port not open")
+        if self.trace_writer:
+            self.trace_writer.stop()
+        if self.capture:
+            self.capture.stop()
+        if self.publisher:
+            self.publisher.stop()
+        if self.telemetry:
+            self.telemetry.stop()
+        if self.alarms:
+            self.alarms.stop()
+        if self.metrics_reporter:
+            self.metrics_reporter.stop()
+        return self.source.stop_threads()
+
+    def is_offline(self, target) -> bool:
+        device = self.devices.get(target)
+        return device is not None and device.timeouts >= self.OFFLINE_TIMEOUTS
+
+    def skip_request(self, command, target) -> bool:
+        # a device that stopped answering must not hold the link with the rest of its cycle, the
+        # healthy ones would wait a timeout per command: only the probe goes out until it answers
+        return self.is_offline(target) and command != ["status"]
+
+    def __info_commands(self, target) -> list:
+        return [] if self.is_offline(target) else [["info"], ["infobal"]]
+
+    def __status_commands(self, target) -> list:
+        if self.is_offline(target):
+            return [["status"]]
+        cells = self.devices[target].cell_count if target in self.devices else self.DEFAULT_CELLS
+        return [["status"]] + [["status" ,{"id": i}] for i in range(cells)]
+
+    def get_cells(self) -> int:
+        if self.selected in self.devices:
+            return self.devices[self.selected].cell_count
+        return self.cells if self.cells else self.DEFAULT_CELLS
+
+    def __sender(self):
+        t = threading.current_thread()
+        while getattr(t, "do_run", True):
+            if self.is_open() is None:
+                if "on_port_disconnect" in self.callbacks:
+                    self.callbacks["on_port_disconnect"]()
+            # blocks until there is work, the timeout only lets us notice do_run and a lost port
+            work = self.msgq.get(timeout=self.SENDER_IDLE_TIMEOUT)
+            if work is None:
+                continue
+            command, target = work
+            if self.skip_request(command, target):
+                continue
+            entry = self.begin_request(command, target)
+            timed_out = bool(self.send_command(command, target))
+            self.end_request(command, target, entry, timed_out)
+
+    def begin_request(self, command, target) -> list:
+        if self.engine and self.is_open() is None and "on_port_disconnect" in self.callbacks:
+            self.callbacks["on_port_disconnect"]()
+        if self.get_devlist() is not None and len(self.get_devlist()) == 0 and "on_no_device_found" in self.callbacks:
+            self.callbacks["on_no_device_found"]()
+        self.metrics.inc("requests")
+        return self.window.begin(command, target)
+
+    def end_request(self, command, target, entry:list, timed_out:bool):
+        self.window.end(entry, timed_out)
+        self.poller.on_result(command, target, time.monotonic() - entry[2], timed_out)
+        device = self.devices.get(target)
+        if device:
+            device.timeouts = device.timeouts + 1 if timed_out else 0
+        if timed_out:
+            self.metrics.inc("timeouts")
+            self.timeouts += 1
+        else:
+            self.timeouts = 0
+        # one dead node behind the adapter is no reason to give up on the others: critical only
+        # once every device is timing out
+        devices = list(self.devices.values())
+        self.on_timeout(min(device.timeouts for device in devices) if devices else self.timeouts)
+        if time.monotonic() - self.__latency_reported >= self.LATENCY_REPORT_PERIOD:
+            self.__latency_reported = time.monotonic()
+            if "on_latency_handler" in self.callbacks:
+                self.callbacks["on_latency_handler"](self.get_latency_stats())
+
+    def connection_state(self) -> str:
+        if self.connect_error:
+            return "failed"
+        return "connected" if self.is_open() else "connecting"
+
+    def update_port_info(self):
+        if "on_get_dongle_info_handler" in self.callbacks:
+            bms_id = 0
+            bal_id = 0
+            if self.can_adapter and self.selected in self.devices:
+                bms_id = self.devices[self.selected].serial
+                bal_id = self.devices[self.selected].bal_serial
+            self.callbacks["on_get_dongle_info_handler"](self.serial_port, self.can_adapter, bms_id, bal_id,
+                                                         self.connection_state())
+        if self.connect_error and "on_connect_failed" in self.callbacks:
+            self.callbacks["on_connect_failed"](self.connect_error)
+
+    def __answer_target(self, data):
+        # answers carry no address, they belong to the request they were matched to
+        entry = self.window.match(data)
+        return entry[4] if entry else self.selected
+
+    def get_device_info_handler(self, data):
+        self.on_info(self.__answer_target(data), data)
+
+    def get_device_status_handler(self, data):
+        self.on_status(self.__answer_target(data), data)
+
+    def on_device_event(self, kind:int, target, data:dict):
+        # decoded traffic with a known sender, e.g. played back from a capture
+        if kind == KIND_STATUS:
+            self.on_status(target, data)
+        elif kind == KIND_INFO:
+            self.on_info(target, data)
+        elif kind == KIND_TRACE:
+            self.get_trace_handler(data)
+
+    def on_info(self, target, data:dict):
+        if self.capture:
+            self.capture.record(KIND_INFO, target, data)
+        if self.publisher:
+            self.publisher.publish(KIND_INFO, target, data)
+        self.metrics.inc("responses")
+        self.poller.on_answer("info", target)
+        if target in self.devices:
+            self.devices[target].info[data["name"] if "name" in data else None] = data
+        if target == self.selected:
+            self.__forward_info(data)
+
+    def on_status(self, target, data:dict):
+        if self.capture:
+            self.capture.record(KIND_STATUS, target, data)
+        if self.publisher:
+            self.publisher.publish(KIND_STATUS, target, data)
+        self.metrics.inc("responses")
+        if target in self.devices:
+            if "id" in data:
+                self.devices[target].cells[data["id"]] = data
+                self.devices[target].history.add(data["id"], data["v"], data["t"])
+                self.devices[target].stats_pending = True
+            elif "flags" in data:
+                self.devices[target].status = data
+                qty = data.get("qty")
+                if self.cells is None and qty and qty <= self.MAX_CELLS and qty != self.devices[target].cell_count:
+                    # the pack is bigger or smaller than assumed, the next cycle polls what it has
+                    self.devices[target].resize(qty)
+                    if target == self.selected:
+                        self.__forward_cells(self.devices[target])
+                if self.telemetry:
+                    # one row per status cycle, with the cells as last reported
+                    self.telemetry.record(self.devices[target].serial, data, self.devices[target].cells)
+                if self.alarms:
+                    # all cells against all rules once per cycle, the UI hears only about changes
+                    if self.alarms.evaluate(self.devices[target].serial, *self.devices[target].history.latest()) \
+                            and target == self.selected:
+                        self.__forward_alarms(self.devices[target])
+        if target == self.selected:
+            self.__forward_status(data)
+            device = self.devices.get(target)
+            # the stats cover the whole pack: once per cycle, when its last cell is in, or with the
+            # status frame of the next cycle if that cell didn't answer
+            if device and device.stats_pending and ("flags" in data or data.get("id") == device.cell_count - 1):
+                device.stats_pending = False
+                self.__forward_pack_stats(device)
+        if time.monotonic() - self.__overview_reported >= self.OVERVIEW_REPORT_PERIOD:
+            self.__overview_reported = time.monotonic()
+            if "on_devices_handler" in self.callbacks:
+                self.callbacks["on_devices_handler"](self.get_devices_overview())
+
+    def __forward_info(self, data):
+        if "on_info_handler" in self.callbacks:
+            with self.metrics.timer("handler"):
+                self.callbacks["on_info_handler"](data)
+
+    def __forward_cells(self, device:DeviceState):
+        if "on_cells_handler" in self.callbacks:
+            self.callbacks["on_cells_handler"](device.cell_count)
+
+    def __forward_pack_stats(self, device:DeviceState):
+        if "on_pack_stats_handler" in self.callbacks:
+            with self.metrics.timer("handler"):
+                self.callbacks["on_pack_stats_handler"](device.history.stats())
+
+    def __forward_alarms(self, device:DeviceState):
+        if self.alarms and "on_alarm_handler" in self.callbacks:
+            last = next((event for event in reversed(self.alarms.log) if event.bms_id == device.serial), None)
+            with self.metrics.timer("handler"):
+                self.callbacks["on_alarm_handler"](self.alarms.active(device.serial), self.alarms.summary(device.serial),
+                                                   str(last) if last else "")
+
+    def __forward_status(self, data):
+        with self.metrics.timer("handler"):
+            if "on_status_handler" in self.callbacks:
+                self.callbacks["on_status_handler"](data)
+            if "flags" in data and "on_flag_handler" in self.callbacks:
+                self.callbacks["on_flag_handler"](data)
+
+    def get_trace_handler(self, data):
+        if self.capture:
+            self.capture.record(KIND_TRACE, None, data)
+        if self.publisher:
+            self.publisher.publish(KIND_TRACE, None, data)
+        chunk = data.get("s")
+        if isinstance(chunk, (bytes, bytearray, memoryview)):
+            self.metrics.inc("trace_bytes", len(chunk))
+        trace = self.trace_decoder.decode(chunk)
+        if not trace:
+            return
+        self.trace_log.append(trace)
+        if self.trace_writer:
+            self.trace_writer.write(trace)
+        if self.batch_trace:
+            with self.__trace_lock:
+                self.__trace_pending.append(trace)
+        else:
+            self.__forward_trace(trace)
+
+    def __forward_trace(self, trace:str):
+        if "on_trace_handler" in self.callbacks:
+            with self.metrics.timer("handler"):
+                self.callbacks["on_trace_handler"](trace)
+
+    def poll(self):
+        # render tick: the trace received since the previous one goes to the UI in one piece
+        with self.__trace_lock:
+            pending, self.__trace_pending = self.__trace_pending, []
+        if pending:
+            self.__forward_trace("".join(pending))
+
+    def __on_metrics(self, metrics:dict):
+        if "on_metrics_handler" in self.callbacks:
+            self.callbacks["on_metrics_handler"](metrics)
+
+    def on_timeout(self, timeouts):
+        if "on_timeout_handler" in self.callbacks:
+            self.callbacks["on_timeout_handler"](timeouts)
+
+    def get_latency_stats(self) -> dict:
+        return self.window.summary()
+
+    def trace_ctrl(self, state:bool):
+        self.msgq.put(["trace" ,{"on": state}], target=self.selected)
+
+    def bal_trace_ctrl(self, state:bool):
+        self.msgq.put(["trace" ,{"bal": state}], target=self.selected)
+
+    def get_trace_log(self)->str:
+        return self.trace_log.text()
+
+    def get_trace_store(self) -> TraceLog:
+        return self.trace_log
+
+    def get_trace_path(self) -> str:
+        if self.trace_writer:
+            return self.trace_writer.path
+        return default_trace_path()
+
+    def save_trace(self, path:str) -> bool:
+        if self.trace_writer:
+            return self.trace_writer.flush(path)
+        try:
+            with open(path, "w") as f:
+                f.write(self.get_trace_log())
+        except OSError:
+            return False
+        return True
+
+    def __on_clear_log(self):
+        self.trace_log.clear()
+
+init_data = {"first_run": True}
+
+def build_scenes(screen, dongle) -> list:
+    return [
+        Scene([BmsToolFrame(screen, dongle.callbacks, init_data)], -1, name="Main"),
+        Scene([FlagFrame(screen, dongle.callbacks)], -1, name="FlagTable"),
+        Scene([DeviceListFrame(screen, dongle.callbacks)], -1, name="Devices"),
+    ]
+
+def restart_screen(screen) -> Screen:
+    screen.close(False)
+    return Screen.open()
+
+def open_source(args):
+    if args.replay:
+        return ReplaySource(args.replay, args.speed)
+    if args.connect:
+        return SubscriberSource(args.connect)
+    if args.simulate:
+        return SimulatedSource(args.sim_cells, args.sim_devices, args.sim_status_hz, args.sim_trace_hz,
+                               args.sim_latency / 1000, args.sim_timeout_rate)
+    return Bms3Source(args.port, can_adapter=args.adapter)
+
+def connect_deadline(args) -> float:
+    # a local capture is only read, however long: nothing to give up on
+    return None if args.replay else args.connect_timeout
+
+def alarm_limits(args) -> dict:
+    # only the limits given on the command line, the engine has defaults for the rest
+    limits = {"ov": args.alarm_ov, "uv": args.alarm_uv, "ot": args.alarm_ot, "imbalance": args.alarm_imbalance,
+              "hysteresis_v": args.alarm_hysteresis, "debounce": args.alarm_debounce, "hook": args.alarm_hook,
+              "log_path": args.alarm_log}
+    return {k: v for k, v in limits.items() if v is not None}
+
+def open_publisher(args) -> tuple:
+    # -> (publisher, error): the address may be taken or not a valid one
+    if not args.publish:
+        return None, None
+    try:
+        return Publisher(args.publish, args.publish_buffer), None
+    except (OSError, ValueError) as e:
+        return None, f"publish on {args.publish}: {type(e).__name__}: {e}"
+
+def build_dongle(args, callbacks:dict={}) -> ConsoleDongle:
+    name = args.port or args.replay or args.connect or "SIMULATOR"
+    publisher, publish_error = open_publisher(args)
+    dongle = ConsoleDongle(PendingSource(name, args.adapter), callbacks=callbacks,
+                         trace_log=TraceLog(args.trace_lines, args.trace_bytes),
+                         trace_writer=TraceWriter(args.trace_file, args.trace_rotate_size, args.trace_rotate_time,
+                                                  args.trace_gzip) if args.trace_file else None,
+                         poll_hz=args.poll_hz, info_backoff_period=args.info_period, window=args.window,
+                         capture=CaptureWriter(args.capture) if args.capture else None,
+                         metrics_reporter=MetricsReporter(Metrics(), path=args.metrics_file, fmt=args.metrics_format,
+                                                          period=args.metrics_period),
+                         engine=args.engine,
+                         telemetry=TelemetryWriter(args.log_telemetry, args.cells, args.telemetry_format,
+                                                   args.telemetry_period, args.telemetry_decimate,
+                                                   max_size=args.telemetry_rotate_size,
+                                                   max_age=args.telemetry_rotate_time) if args.log_telemetry else None,
+                         alarms=None if args.no_alarms else AlarmEngine(**alarm_limits(args)),
+                         publisher=publisher,
+                         cells=args.cells)
+    if publish_error:
+        # shown like a source that couldn't be opened
+        dongle.connect_error = publish_error
+    return dongle
+
+def acquire(args, state_name:str, ring_name:str, ring_size:int, conn):
+    # the acquisition process of --split: owns the port and the dongle, reports to shared memory
+    # and takes the commands of the UI from the pipe until it is told to stop
+    # the block is sized once, for the most cells a device may report
+    state = SharedState(args.cells if args.cells else ConsoleDongle.MAX_CELLS, state_name)
+    ring = SharedRing(ring_size, ring_name)
+    dongle = build_dongle(args, StatePublisher(state, ring).callbacks)
+    dongle.metrics.gauge_fn("state_dropped", lambda: state.dropped)
+    dongle.start()
+    dongle.connect(functools.partial(open_source, args), connect_deadline(args))
+    while True:
+        try:
+            command, command_args = conn.recv()
+        except (EOFError, OSError, KeyboardInterrupt):
+            break
+        if command == "stop":
+            break
+        result = dongle.callbacks[command](*command_args)
+        if command == "save_trace":
+            conn.send(result)
+    dongle.stop_threads()
+    state.close()
+    ring.close()
+
+def run(args):
+    os.system('mode con: cols=120 lines=29')
+    if args.split:
+        dongle = RemoteDongle(args.cells if args.cells else ConsoleDongle.MAX_CELLS, acquire, args,
+                              TraceLog(args.trace_lines, args.trace_bytes),
+                              args.trace_file if args.trace_file else default_trace_path(),
+                              cell_count=args.cells if args.cells else ConsoleDongle.DEFAULT_CELLS)
+        dongle.start()
+    else:
+        dongle = build_dongle(args)
+        dongle.batch_trace = True
+        dongle.start()
+        dongle.connect(functools.partial(open_source, args), connect_deadline(args))
+    last_scene = None
+    screen = Screen.open()
+    redraw = RedrawScheduler(args.max_fps, dongle.metrics, on_tick=dongle.poll)
+    dongle.callbacks.update({"mark_dirty": redraw.mark_dirty, "post_update": redraw.updates.post})
+    scenes = build_scenes(screen, dongle)
+    while True:
+        try:
+            redraw.play(screen, scenes, stop_on_resize=True, start_scene=last_scene)
+        except ResizeScreenError as e:
+            # the frames and everything in them are kept, they only get laid out for the new size
+            try:
+                resize_screen(screen, scenes)
+            except Exception:
+                # the in place layout leans on asciimatics internals: open the screen and build
+                # the scenes again if this version doesn't have them
+                screen = restart_screen(screen)
+                scenes = build_scenes(screen, dongle)
+            last_scene = e.scene
+        except AttributeError:
+            screen = restart_screen(screen)
+            scenes = build_scenes(screen, dongle)
+            last_scene = None
+        except (ExitFromApp, KeyboardInterrupt) as e:
+            if dongle:
+                dongle.stop_threads()
+                dongle = None
+            break
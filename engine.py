@@ -0,0 +1,148 @@
+import asyncio, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+from scheduler import CommandQueue, PollScheduler
+
+
+class AsyncCommandQueue(CommandQueue):
+    # CommandQueue whose consumers are coroutines, put() stays callable from any thread
+    def __init__(self):
+        super().__init__()
+        self.loop = None
+        self.__ready = None
+
+    def bind(self, loop):
+        self.loop = loop
+        self.__ready = asyncio.Event()
+
+    def put(self, command:list, priority:int=CommandQueue.PRIORITY_USER, coalesce:bool=False, target=None) -> bool:
+        queued = super().put(command, priority, coalesce, target)
+        if queued and self.loop:
+            try:
+                self.loop.call_soon_threadsafe(self.__ready.set)
+            except RuntimeError:
+                # the loop is gone, nobody is left to take the command
+                pass
+        return queued
+
+    async def get_async(self):
+        # -> (command, target)
+        while True:
+            work = self.get(timeout=0)
+            if work is not None:
+                return work
+            self.__ready.clear()
+            await self.__ready.wait()
+
+
+class AsyncPollScheduler(PollScheduler):
+    # the poll timers of PollScheduler driven by the event loop instead of the thread
+    def __init__(self, msgq:CommandQueue):
+        super().__init__(msgq)
+        self.loop = None
+        self.__wake = None
+
+    def bind(self, loop):
+        self.loop = loop
+        self.__wake = asyncio.Event()
+
+    def wake(self):
+        if self.loop:
+            try:
+                self.loop.call_soon_threadsafe(self.__wake.set)
+            except RuntimeError:
+                pass
+
+    async def run_async(self):
+        while True:
+            now = time.monotonic()
+            task = self.next_task()
+            if task is None or task.next_due > now:
+                try:
+                    await asyncio.wait_for(self.__wake.wait(), task.next_due - now if task else None)
+                except asyncio.TimeoutError:
+                    pass
+                self.__wake.clear()
+                continue
+            self.poll(task, now)
+
+
+class AsyncEngine(threading.Thread):
+    # Runs the poll timers and the senders of a ConsoleDongle as coroutines on one event loop.
+    # Sources with a send_async coroutine are awaited directly, the blocking send_data_to_port of
+    # the others runs on a pool with one worker per in-flight slot.
+    DEFAULT_REQUEST_TIMEOUT = 2.0
+
+    def __init__(self, dongle, window:int, request_timeout:float=DEFAULT_REQUEST_TIMEOUT):
+        super().__init__(group=None, name="async_engine", daemon=True)
+        self.dongle = dongle
+        self.window = window
+        self.request_timeout = request_timeout
+        self.msgq = AsyncCommandQueue()
+        self.poller = AsyncPollScheduler(self.msgq)
+        self.loop = asyncio.new_event_loop()
+        self.msgq.bind(self.loop)
+        self.poller.bind(self.loop)
+        self.__executor = None
+        self.__main = None
+        # signalled whenever a request finished, senders wait on it for the answer key to be free
+        self.__released = None
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.__main = self.loop.create_task(self.__run())
+        try:
+            self.loop.run_until_complete(self.__main)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.loop.close()
+            if self.__executor:
+                self.__executor.shutdown(wait=True)
+
+    def stop(self):
+        if self.is_alive():
+            self.loop.call_soon_threadsafe(self.__cancel)
+            self.join()
+
+    def __cancel(self):
+        if self.__main:
+            self.__main.cancel()
+
+    async def __run(self):
+        self.__released = asyncio.Condition()
+        tasks = [asyncio.create_task(self.__sender()) for _ in range(self.window)]
+        if self.dongle.source.POLLED:
+            tasks.append(asyncio.create_task(self.poller.run_async()))
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def __send(self, command, target) -> bool:
+        # -> True on timeout
+        send_async = getattr(self.dongle.source, "send_async", None)
+        if send_async:
+            try:
+                return bool(await asyncio.wait_for(send_async(command, channel=target), self.request_timeout))
+            except asyncio.TimeoutError:
+                return True
+        if self.__executor is None:
+            self.__executor = ThreadPoolExecutor(self.window, thread_name_prefix="async_send")
+        return bool(await self.loop.run_in_executor(self.__executor, self.dongle.send_command, command, target))
+
+    async def __sender(self):
+        while True:
+            command, target = await self.msgq.get_async()
+            if self.dongle.skip_request(command, target):
+                continue
+            async with self.__released:
+                # the window's own wait would block the loop, and with it the request holding the key
+                await self.__released.wait_for(lambda: self.dongle.window.free(command))
+                entry = self.dongle.begin_request(command, target)
+            timed_out = await self.__send(command, target)
+            self.dongle.end_request(command, target, entry, timed_out)
+            async with self.__released:
+                self.__released.notify_all()
@@ -0,0 +1,125 @@
+import os, json, threading, time
+from contextlib import contextmanager
+
+
+class Metrics:
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        # name -> [count, total seconds, max seconds]
+        self.timings = {}
+        self.__gauge_fns = {}
+        self.__lock = threading.Lock()
+
+    def inc(self, name:str, n:int=1):
+        with self.__lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def set(self, name:str, value:float):
+        self.gauges[name] = value
+
+    def gauge_fn(self, name:str, fn):
+        # gauge sampled when a snapshot is taken, e.g. a queue length
+        self.__gauge_fns[name] = fn
+
+    def observe(self, name:str, seconds:float):
+        with self.__lock:
+            timing = self.timings.setdefault(name, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    @contextmanager
+    def timer(self, name:str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def snapshot(self) -> dict:
+        for name, fn in list(self.__gauge_fns.items()):
+            try:
+                self.gauges[name] = fn()
+            except Exception:
+                pass
+        with self.__lock:
+            return {
+                "time": time.time(),
+                "counters": dict(self.counters),
+                "gauges": dict(self.gauges),
+                "timings": {name: list(timing) for name, timing in self.timings.items()},
+            }
+
+
+def with_rates(snapshot:dict, previous:dict) -> dict:
+    # per second rates of the counters and mean timings over the interval between two snapshots
+    dt = snapshot["time"] - previous["time"] if previous else 0
+    rates = {}
+    means = {}
+    for name, value in snapshot["counters"].items():
+        rates[name] = (value - previous["counters"].get(name, 0)) / dt if dt > 0 else 0.0
+    for name, (count, total, _) in snapshot["timings"].items():
+        prev_count, prev_total, _ = previous["timings"].get(name, (0, 0.0, 0.0)) if previous else (0, 0.0, 0.0)
+        means[name] = (total - prev_total) / (count - prev_count) if count > prev_count else None
+    return dict(snapshot, rates=rates, means=means)
+
+
+def to_prometheus(snapshot:dict, prefix:str="bms3tool") -> str:
+    lines = []
+    for name, value in sorted(snapshot["counters"].items()):
+        lines.append(f"# TYPE {prefix}_{name}_total counter")
+        lines.append(f"{prefix}_{name}_total {value}")
+    for name, value in sorted(snapshot["gauges"].items()):
+        lines.append(f"# TYPE {prefix}_{name} gauge")
+        lines.append(f"{prefix}_{name} {value}")
+    for name, (count, total, maximum) in sorted(snapshot["timings"].items()):
+        lines.append(f"# TYPE {prefix}_{name}_seconds summary")
+        lines.append(f"{prefix}_{name}_seconds_count {count}")
+        lines.append(f"{prefix}_{name}_seconds_sum {total:.6f}")
+        lines.append(f"# TYPE {prefix}_{name}_seconds_max gauge")
+        lines.append(f"{prefix}_{name}_seconds_max {maximum:.6f}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsReporter(threading.Thread):
+    DEFAULT_PERIOD = 1.0
+
+    def __init__(self, metrics:Metrics, on_report=None, path:str=None, fmt:str=None, period:float=DEFAULT_PERIOD):
+        super().__init__(group=None, name="metrics_reporter", daemon=True)
+        self.metrics = metrics
+        self.on_report = on_report
+        self.path = path
+        self.fmt = fmt if fmt else ("json" if path and path.endswith(".json") else "prom")
+        self.period = period
+        self.error = None
+        self.__stop = threading.Event()
+
+    def stop(self):
+        self.__stop.set()
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        previous = None
+        while not self.__stop.wait(self.period):
+            snapshot = with_rates(self.metrics.snapshot(), previous)
+            previous = snapshot
+            if self.on_report:
+                self.on_report(snapshot)
+            if self.path:
+                self.__export(snapshot)
+
+    def __export(self, snapshot:dict):
+        # write aside and rename, so a scraper never reads a half written file
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                if self.fmt == "json":
+                    json.dump(snapshot, f)
+                else:
+                    f.write(to_prometheus(snapshot))
+            os.replace(tmp, self.path)
+            self.error = None
+        except OSError as e:
+            self.error = e
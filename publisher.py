@@ -0,0 +1,295 @@
+import os, socket, selectors, threading
+from collections import deque
+
+from capture import MAGIC, RECORD_HEADER, KIND_STATUS, KIND_INFO, ReplayDevice, encode_record, decode_payload
+from sources import DeviceSource
+
+
+def parse_address(address:str) -> tuple:
+    # -> (family, address): "host:port" or ":port" is TCP on that host (localhost by default),
+    # anything else a Unix socket path
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return socket.AF_INET, (host if host else "127.0.0.1", int(port))
+    if not hasattr(socket, "AF_UNIX"):
+        raise ValueError(f"{address}: use host:port, Unix sockets are not available here")
+    return socket.AF_UNIX, address
+
+
+class Subscriber:
+    def __init__(self, sock, max_records:int):
+        self.sock = sock
+        # encoded records waiting to be sent, the oldest go first when a slow client falls behind
+        self.records = deque(maxlen=max_records)
+        self.dropped = 0
+        # rest of the record being sent, a record is never cut in favour of a newer one
+        self.out = b""
+
+
+class Publisher(threading.Thread):
+    # Streams the decoded device traffic of a dongle to local subscribers in the capture format:
+    # MAGIC, then records of header and payload. Records are encoded once and queued per
+    # subscriber, a subscriber that doesn't keep up loses its oldest records instead of holding
+    # up the dongle or the others. A new subscriber first gets the latest info and status.
+    DEFAULT_BUFFER_RECORDS = 10000
+    SEND_SIZE = 64 * 1024
+
+    def __init__(self, address:str, max_records:int=DEFAULT_BUFFER_RECORDS):
+        super().__init__(group=None, name="publisher", daemon=True)
+        self.address = address
+        self.max_records = max_records
+        self.error = None
+        self.dropped = 0
+        self.__family, self.__address = parse_address(address)
+        self.__subscribers = []
+        self.__latest = {}
+        self.__lock = threading.Lock()
+        self.__selector = selectors.DefaultSelector()
+        self.__wake_r, self.__wake_w = socket.socketpair()
+        self.__wake_r.setblocking(False)
+        self.__wake_w.setblocking(False)
+        # one wake up byte per burst of records is enough
+        self.__wake_pending = False
+        self.__stop = False
+        try:
+            self.__listener = self.__listen()
+        except OSError:
+            self.__wake_r.close()
+            self.__wake_w.close()
+            self.__selector.close()
+            raise
+
+    def __listen(self):
+        if self.__family == socket.AF_UNIX and os.path.exists(self.__address):
+            # left over from a run that didn't get to remove it
+            os.remove(self.__address)
+        listener = socket.socket(self.__family, socket.SOCK_STREAM)
+        if self.__family == socket.AF_INET:
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        try:
+            listener.bind(self.__address)
+            listener.listen()
+        except OSError:
+            listener.close()
+            raise
+        listener.setblocking(False)
+        return listener
+
+    @property
+    def subscribers(self) -> int:
+        return len(self.__subscribers)
+
+    def publish(self, kind:int, target, data:dict):
+        record = encode_record(kind, target, data)
+        with self.__lock:
+            if kind == KIND_INFO:
+                self.__latest[(kind, target, data.get("name"))] = record
+            elif kind == KIND_STATUS:
+                self.__latest[(kind, target, data.get("id"))] = record
+            for subscriber in self.__subscribers:
+                if len(subscriber.records) == subscriber.records.maxlen:
+                    subscriber.dropped += 1
+                    self.dropped += 1
+                subscriber.records.append(record)
+        if self.__subscribers:
+            self.__wake()
+
+    def __wake(self, force:bool=False):
+        if self.__wake_pending and not force:
+            return
+        self.__wake_pending = True
+        try:
+            self.__wake_w.send(b"\0")
+        except OSError:
+            pass
+
+    def stop(self):
+        self.__stop = True
+        self.__wake(True)
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        self.__selector.register(self.__listener, selectors.EVENT_READ)
+        self.__selector.register(self.__wake_r, selectors.EVENT_READ)
+        while not self.__stop:
+            for key, events in self.__selector.select():
+                if key.fileobj is self.__listener:
+                    self.__accept()
+                elif key.fileobj is self.__wake_r:
+                    self.__drain_wake()
+                elif events & selectors.EVENT_READ:
+                    # subscribers don't talk, readable means they went away
+                    self.__read(key.data)
+                elif events & selectors.EVENT_WRITE:
+                    self.__send(key.data)
+            self.__update_interest()
+        self.__close()
+
+    def __accept(self):
+        try:
+            sock, _ = self.__listener.accept()
+        except OSError as e:
+            self.error = e
+            return
+        sock.setblocking(False)
+        subscriber = Subscriber(sock, self.max_records)
+        subscriber.out = MAGIC
+        with self.__lock:
+            subscriber.records.extend(self.__latest.values())
+            self.__subscribers.append(subscriber)
+        self.__selector.register(sock, selectors.EVENT_READ | selectors.EVENT_WRITE, subscriber)
+
+    def __drain_wake(self):
+        try:
+            while self.__wake_r.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+        # only now: a record published meanwhile is picked up by this round already
+        self.__wake_pending = False
+
+    def __read(self, subscriber:Subscriber):
+        try:
+            if subscriber.sock.recv(4096):
+                return
+        except BlockingIOError:
+            return
+        except OSError:
+            pass
+        self.__drop(subscriber)
+
+    def __send(self, subscriber:Subscriber):
+        with self.__lock:
+            # as many whole records as fit in one send
+            chunks = [subscriber.out]
+            size = len(subscriber.out)
+            while subscriber.records and size < self.SEND_SIZE:
+                record = subscriber.records.popleft()
+                chunks.append(record)
+                size += len(record)
+        data = b"".join(chunks)
+        try:
+            sent = subscriber.sock.send(data)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self.__drop(subscriber)
+            return
+        subscriber.out = data[sent:]
+
+    def __update_interest(self):
+        with self.__lock:
+            subscribers = list(self.__subscribers)
+        for subscriber in subscribers:
+            events = selectors.EVENT_READ
+            if subscriber.out or subscriber.records:
+                events |= selectors.EVENT_WRITE
+            try:
+                self.__selector.modify(subscriber.sock, events, subscriber)
+            except (KeyError, ValueError):
+                pass
+
+    def __drop(self, subscriber:Subscriber):
+        with self.__lock:
+            if subscriber in self.__subscribers:
+                self.__subscribers.remove(subscriber)
+        try:
+            self.__selector.unregister(subscriber.sock)
+        except (KeyError, ValueError):
+            pass
+        subscriber.sock.close()
+
+    def __close(self):
+        for subscriber in list(self.__subscribers):
+            self.__drop(subscriber)
+        self.__selector.close()
+        self.__listener.close()
+        self.__wake_r.close()
+        self.__wake_w.close()
+        if self.__family == socket.AF_UNIX:
+            try:
+                os.remove(self.__address)
+            except OSError:
+                pass
+
+
+class SubscriberSource(DeviceSource):
+    # Device traffic from the publisher of another instance: nothing is polled or sent, the
+    # records are pushed to the dongle as they come. Devices show up as their records do.
+    POLLED = False
+    CONNECT_TIMEOUT = 3.0
+    RECEIVE_SIZE = 64 * 1024
+
+    def __init__(self, address:str):
+        super().__init__(address, can_adapter=False)
+        family, addr = parse_address(address)
+        self.sock = socket.socket(family, socket.SOCK_STREAM)
+        self.sock.settimeout(self.CONNECT_TIMEOUT)
+        self.sock.connect(addr)
+        magic = b""
+        while len(magic) < len(MAGIC):
+            chunk = self.sock.recv(len(MAGIC) - len(magic))
+            if not chunk:
+                raise ValueError(f"{address} closed the connection")
+            magic += chunk
+        if magic != MAGIC:
+            raise ValueError(f"{address} is not a BMS3 publisher")
+        self.sock.settimeout(None)
+        self.__devlist = []
+        self.__closed = False
+        self.__thread = threading.Thread(target=self.__receive, name="subscriber", daemon=True)
+
+    def is_open(self):
+        # None once the publisher went away, the dongle reports it as a lost port
+        return None if self.__closed else self.serial_port
+
+    def get_devlist(self) -> list:
+        return self.__devlist if self.can_adapter else None
+
+    def start_threads(self):
+        self.__thread.start()
+
+    def stop_threads(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+        if self.__thread.is_alive() and self.__thread != threading.current_thread():
+            self.__thread.join()
+
+    def __seen(self, target):
+        if target is None or any(dev.serial == target for dev in self.__devlist):
+            return
+        self.__devlist.append(ReplayDevice(target))
+        self.can_adapter = True
+        if self.dongle:
+            self.dongle.can_adapter = True
+            self.dongle.update_devices()
+            self.dongle.update_port_info()
+
+    def __receive(self):
+        buffer = bytearray()
+        while True:
+            try:
+                chunk = self.sock.recv(self.RECEIVE_SIZE)
+            except OSError:
+                chunk = b""
+            if not chunk:
+                break
+            buffer += chunk
+            offset = 0
+            while offset + RECORD_HEADER.size <= len(buffer):
+                length, ts, kind, target = RECORD_HEADER.unpack_from(buffer, offset)
+                if offset + RECORD_HEADER.size + length > len(buffer):
+                    break
+                start = offset + RECORD_HEADER.size
+                kind, data = decode_payload(kind, buffer[start:start + length])
+                offset = start + length
+                target = target if target else None
+                self.__seen(target)
+                if self.dongle:
+                    self.dongle.on_device_event(kind, target, data)
+            del buffer[:offset]
+        self.__closed = True
@@ -0,0 +1,150 @@
+import os, sys, threading, itertools, time
+
+from asciimatics.exceptions import ResizeScreenError, StopApplication
+
+
+class UpdateChannel:
+    # Widget updates posted from the device threads and applied on the UI thread once per render
+    # tick. Only the latest update per key is kept.
+    # Posts with key None (popups) are all kept, in order.
+    def __init__(self, on_post=None):
+        self.on_post = on_post
+        self.posted = 0
+        self.applied = 0
+        self.__pending = {}
+        self.__seq = itertools.count()
+        self.__lock = threading.Lock()
+
+    def post(self, key, fn, *args):
+        if key is None:
+            key = ("unique", next(self.__seq))
+        with self.__lock:
+            self.posted += 1
+            self.__pending[key] = (fn, args)
+        if self.on_post:
+            self.on_post(key)
+
+    def drain(self) -> int:
+        with self.__lock:
+            pending, self.__pending = self.__pending, {}
+        for fn, args in pending.values():
+            fn(*args)
+        self.applied += len(pending)
+        return len(pending)
+
+
+class RedrawScheduler:
+    DEFAULT_MAX_FPS = 20
+
+    def __init__(self, max_fps:float=DEFAULT_MAX_FPS, metrics=None, on_tick=None):
+        self.max_fps = max_fps
+        self.metrics = metrics
+        # called first thing every tick, e.g. to pick up the state of the acquisition process
+        self.on_tick = on_tick
+        self.redraws = 0
+        # applied at the start of every draw(), the widgets it touches mark themselves dirty
+        self.updates = UpdateChannel()
+        self.__dirty = set()
+        self.__lock = threading.Lock()
+
+    @property
+    def frame_time(self) -> float:
+        return 1.0 / self.max_fps
+
+    def mark_dirty(self, name=None):
+        # name of the changed widget, None when the whole frame (popup, layout) changed
+        with self.__lock:
+            self.__dirty.add(name)
+
+    def is_dirty(self) -> bool:
+        return bool(self.__dirty)
+
+    def take_dirty(self) -> set:
+        with self.__lock:
+            dirty, self.__dirty = self.__dirty, set()
+        return dirty
+
+    def draw(self, screen, stop_on_resize=True):
+        # one render tick: redraw only if something was marked dirty or input arrived
+        a = time.time()
+        if self.on_tick:
+            self.on_tick()
+        if self.updates.drain() and self.metrics:
+            self.metrics.observe("apply", time.time() - a)
+        b = time.time()
+        dirty = self.take_dirty()
+        if dirty:
+            self.redraws += 1
+            screen.force_update()
+        screen.draw_next_frame(repeat=True)
+        if dirty and self.metrics:
+            # only the ticks that actually redrew, idle ticks would hide the render cost
+            self.metrics.observe("render", time.time() - b)
+        if stop_on_resize and screen.has_resized():
+            scene = screen.current_scene
+            scene.exit()
+            raise ResizeScreenError("Screen resized", scene)
+        pause = a + self.frame_time - time.time()
+        if pause > 0:
+            screen.wait_for_input(pause)
+
+    def play(self, screen, scenes, stop_on_resize=True, start_scene=None, unhandled_input=None):
+        screen.set_scenes(scenes, unhandled_input=unhandled_input, start_scene=start_scene)
+        try:
+            while True:
+                self.draw(screen, stop_on_resize)
+        except StopApplication:
+            return
+
+
+def terminal_size(screen) -> tuple:
+    # -> (height, width)
+    if hasattr(screen, "_last_width"):
+        # Windows console: the visible window of the buffer, as measured by has_resized()
+        info = screen._stdout.GetConsoleScreenBufferInfo()["Window"]
+        return info.Bottom - info.Top + 1, info.Right - info.Left + 1
+    try:
+        size = os.get_terminal_size(sys.__stdout__.fileno())
+        return size.lines, size.columns
+    except (OSError, ValueError, AttributeError):
+        return screen.height, screen.width
+
+
+def relayout(frame, screen, height:int, width:int):
+    # asciimatics sizes a frame once, when it is built: move the existing layouts and widgets onto
+    # a canvas of the new size instead of building the frame and its content again
+    from asciimatics.screen import Canvas
+    from asciimatics.widgets.frame import _BorderManager
+    frame._screen = screen
+    frame._canvas = Canvas(screen, height, width)
+    frame._border_mgr = _BorderManager(frame, frame._border_mgr.has_border, frame._border_mgr.can_scroll)
+    for layout in frame._layouts:
+        for column in layout._columns:
+            for widget in column:
+                # list boxes keep their scroll bar on the old canvas, it is added back on the next update
+                if getattr(widget, "_scroll_bar", None):
+                    widget._scroll_bar = None
+    frame.fix()
+
+
+def resize_screen(screen, scenes:list):
+    # the screen reads the terminal size only when it is opened: take the new size in place and lay
+    # the retained frames out again, full screen frames get the new size, popups are centred again
+    from asciimatics.widgets import Frame
+    old_size = (screen.height, screen.width)
+    screen.height, screen.width = terminal_size(screen)
+    screen._buffer_height = screen.height
+    if hasattr(screen, "_last_width"):
+        # the Windows screen compares against the size it was opened with, it would report the
+        # same resize again on every tick
+        screen._last_height, screen._last_width = screen.height, screen.width
+    screen.reset()
+    screen.clear()
+    for scene in scenes:
+        for effect in scene.effects:
+            if isinstance(effect, Frame):
+                if (effect.canvas.height, effect.canvas.width) == old_size:
+                    relayout(effect, screen, screen.height, screen.width)
+                else:
+                    relayout(effect, screen, min(effect.canvas.height, screen.height),
+                             min(effect.canvas.width, screen.width))
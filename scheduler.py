@@ -0,0 +1,310 @@
+import threading, heapq, itertools, time, math
+
+# threads: PollScheduler plus sender threads, asyncio: engine.AsyncEngine
+ENGINES = ("threads", "asyncio")
+
+
+def command_key(command:list) -> tuple:
+    # ["status", {"id": 3}] -> ("status", (("id", 3),)), hashable and stable
+    key = []
+    for part in command:
+        key.append(tuple(sorted(part.items())) if type(part) == dict else part)
+    return tuple(key)
+
+
+class CommandQueue:
+    PRIORITY_USER = 0
+    PRIORITY_POLL = 10
+
+    def __init__(self):
+        self.__heap = []
+        self.__pending = set()
+        self.__seq = itertools.count()
+        self.__cond = threading.Condition()
+        self.__closed = False
+        self.coalesced = 0
+
+    def put(self, command:list, priority:int=PRIORITY_USER, coalesce:bool=False, target=None) -> bool:
+        # target is the device the command is addressed to, None for the only/default one
+        key = (target, command_key(command)) if coalesce else None
+        with self.__cond:
+            if key is not None and key in self.__pending:
+                self.coalesced += 1
+                return False
+            if key is not None:
+                self.__pending.add(key)
+            heapq.heappush(self.__heap, (priority, next(self.__seq), key, command, target))
+            self.__cond.notify()
+        return True
+
+    def get(self, timeout:float=None):
+        # -> (command, target) or None on timeout/close
+        with self.__cond:
+            if not self.__cond.wait_for(lambda: self.__heap or self.__closed, timeout):
+                return None
+            if not self.__heap:
+                return None
+            _, _, key, command, target = heapq.heappop(self.__heap)
+            if key is not None:
+                self.__pending.discard(key)
+            return command, target
+
+    def close(self):
+        with self.__cond:
+            self.__closed = True
+            self.__cond.notify_all()
+
+    def empty(self) -> bool:
+        return not self.__heap
+
+    def qsize(self) -> int:
+        return len(self.__heap)
+
+
+class PollTask:
+    def __init__(self, name:str, commands, period:float, backoff_period:float=None, adaptive:bool=False,
+                 target=None):
+        self.name = name
+        self.target = target
+        # callable returning the list of commands for one poll cycle
+        self.commands = commands
+        self.period = period
+        self.backoff_period = backoff_period
+        self.adaptive = adaptive
+        self.current_period = period
+        self.next_due = 0.0
+        self.batch_size = 0
+        self.rtt = None
+        self.timeout_rate = 0.0
+        self.slowdown = 1
+        self.answered = False
+
+    @property
+    def hz(self) -> float:
+        return 1.0 / self.current_period
+
+
+class PollScheduler(threading.Thread):
+    DEFAULT_POLL_HZ = 1.0
+    DEFAULT_INFO_BACKOFF_PERIOD = 30.0
+    RTT_ALPHA = 0.2
+    TIMEOUT_ALPHA = 0.1
+    # share of the link time one adaptive task may take with its polls
+    MAX_LINK_SHARE = 0.5
+    TIMEOUT_RATE_LIMIT = 0.2
+    MAX_SLOWDOWN = 16
+
+    def __init__(self, msgq:CommandQueue):
+        super().__init__(group=None, name="poll_scheduler", daemon=True)
+        self.msgq = msgq
+        self.tasks = {}
+        self.__by_command = {}
+        self.__wake = threading.Event()
+
+    def add(self, task:PollTask, offset:float=0.0):
+        # offset staggers tasks of several devices so their cycles don't hit the link together
+        task.next_due = time.monotonic() + offset
+        self.tasks[(task.name, task.target)] = task
+        self.wake()
+
+    def remove(self, name:str, target=None):
+        self.tasks.pop((name, target), None)
+
+    def on_answer(self, name:str, target=None):
+        task = self.tasks.get((name, target))
+        if task and not task.answered:
+            task.answered = True
+            if task.backoff_period:
+                task.current_period = task.backoff_period
+                task.next_due = time.monotonic() + task.current_period
+
+    def on_result(self, command:list, target, rtt:float, timed_out:bool):
+        task = self.__by_command.get((command[0], target))
+        if task is None:
+            return
+        task.timeout_rate += self.TIMEOUT_ALPHA * ((1.0 if timed_out else 0.0) - task.timeout_rate)
+        if not timed_out:
+            task.rtt = rtt if task.rtt is None else task.rtt + self.RTT_ALPHA * (rtt - task.rtt)
+
+    def wake(self):
+        self.__wake.set()
+
+    def stop(self):
+        self.do_run = False
+        self.wake()
+        if self.is_alive():
+            self.join()
+
+    def __adapt(self, task:PollTask):
+        if task.timeout_rate > self.TIMEOUT_RATE_LIMIT:
+            task.slowdown = min(task.slowdown * 2, self.MAX_SLOWDOWN)
+        elif task.timeout_rate < self.TIMEOUT_RATE_LIMIT / 4:
+            task.slowdown = max(task.slowdown // 2, 1)
+        period = task.period
+        if task.rtt is not None:
+            # a full cycle must not keep the link busier than MAX_LINK_SHARE
+            period = max(period, task.rtt * task.batch_size / self.MAX_LINK_SHARE)
+        task.current_period = period * task.slowdown
+
+    def next_task(self) -> PollTask:
+        return min(list(self.tasks.values()), key=lambda x: x.next_due) if self.tasks else None
+
+    def run(self):
+        t = threading.current_thread()
+        while getattr(t, "do_run", True):
+            now = time.monotonic()
+            task = self.next_task()
+            if task is None or task.next_due > now:
+                self.__wake.wait(task.next_due - now if task else None)
+                self.__wake.clear()
+                continue
+            self.poll(task, now)
+
+    def poll(self, task:PollTask, now:float):
+        batch = task.commands()
+        for command in batch:
+            self.__by_command[(command[0], task.target)] = task
+            self.msgq.put(command, CommandQueue.PRIORITY_POLL, coalesce=True, target=task.target)
+        task.batch_size = len(batch)
+        if task.adaptive:
+            self.__adapt(task)
+        # never try to catch up missed cycles in a burst
+        task.next_due = max(task.next_due + task.current_period, now)
+
+
+def command_type(command:list) -> str:
+    if command[0] == "status" and len(command) > 1 and "id" in command[1]:
+        return "status id"
+    return command[0]
+
+
+def response_type(data:dict) -> str:
+    if "id" in data:
+        return "status id"
+    if "flags" in data:
+        return "status"
+    if "name" in data:
+        return "infobal" if data["name"] == "BAL3" else "info"
+    return None
+
+
+class LatencyHistogram:
+    # log spaced buckets from 100 us up to ~10 s, 10 buckets per decade
+    MIN_LATENCY = 1e-4
+    BUCKETS_PER_DECADE = 10
+    BUCKETS = 50
+
+    def __init__(self):
+        self.counts = [0] * (self.BUCKETS + 1)
+        self.count = 0
+        self.timeouts = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, latency:float):
+        if latency <= self.MIN_LATENCY:
+            i = 0
+        else:
+            i = min(int(math.log10(latency / self.MIN_LATENCY) * self.BUCKETS_PER_DECADE) + 1, self.BUCKETS)
+        self.counts[i] += 1
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+
+    def bucket_limit(self, i:int) -> float:
+        return self.MIN_LATENCY * 10 ** (i / self.BUCKETS_PER_DECADE)
+
+    def percentile(self, p:float) -> float:
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(self.bucket_limit(i), self.max)
+        return self.max
+
+    def summary(self) -> dict:
+        return {
+            "count": self.count,
+            "timeouts": self.timeouts,
+            "mean": self.total / self.count if self.count else None,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+class InFlightWindow:
+    DEFAULT_SIZE = 1
+
+    def __init__(self, size:int=DEFAULT_SIZE):
+        self.size = size
+        self.histograms = {}
+        self.__inflight = []
+        self.__cond = threading.Condition()
+
+    @staticmethod
+    def __key(command:list) -> tuple:
+        kind = command_type(command)
+        return kind, command[1]["id"] if kind == "status id" else None
+
+    def __blocked(self, key:tuple) -> bool:
+        # a full window, or a request in flight that gets the same answer
+        return len(self.__inflight) >= self.size or \
+            any(entry[0] == key[0] and entry[1] == key[1] for entry in self.__inflight)
+
+    def free(self, command:list) -> bool:
+        # answers carry no address: while a request is in flight, another one that gets the same
+        # answer, e.g. the same cell of another device, couldn't be told apart from it
+        with self.__cond:
+            return not self.__blocked(self.__key(command))
+
+    def begin(self, command:list, target=None) -> list:
+        # waits for a free slot, and for the request with the same answer to finish: one slot per
+        # answer key
+        kind, key = self.__key(command)
+        with self.__cond:
+            self.__cond.wait_for(lambda: not self.__blocked((kind, key)))
+            # [type, match key, sent at, answered, target]
+            entry = [kind, key, time.monotonic(), False, target]
+            self.__inflight.append(entry)
+        return entry
+
+    def match(self, data:dict) -> list:
+        # -> the in-flight entry the answer belongs to, None if it can't be matched
+        kind = response_type(data)
+        if kind is None:
+            return None
+        key = data["id"] if kind == "status id" else None
+        now = time.monotonic()
+        with self.__cond:
+            for entry in self.__inflight:
+                if entry[0] == kind and entry[1] == key and not entry[3]:
+                    entry[3] = True
+                    self.__histogram(kind).add(now - entry[2])
+                    return entry
+        return None
+
+    def end(self, entry:list, timed_out:bool):
+        with self.__cond:
+            self.__inflight.remove(entry)
+            if timed_out:
+                self.__histogram(entry[0]).timeouts += 1
+            elif not entry[3]:
+                # commands without a decoded answer (trace control) are timed to the ack
+                self.__histogram(entry[0]).add(time.monotonic() - entry[2])
+            self.__cond.notify_all()
+
+    def outstanding(self) -> int:
+        return len(self.__inflight)
+
+    def summary(self) -> dict:
+        with self.__cond:
+            return {kind: h.summary() for kind, h in self.histograms.items()}
+
+    def __histogram(self, kind:str) -> LatencyHistogram:
+        if kind not in self.histograms:
+            self.histograms[kind] = LatencyHistogram()
+        return self.histograms[kind]
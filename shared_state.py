@@ -0,0 +1,323 @@
+import json, struct, threading, time
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from trace_log import TraceLog, TraceDecoder
+from metrics import Metrics, with_rates
+
+
+def _to_json(value):
+    # numpy arrays and scalars in the handler arguments, e.g. the dV/dt of the pack stats
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return str(value)
+
+
+class SharedState:
+    # One shared memory block written by the acquisition process and read by the UI: the cells as
+    # arrays and the latest arguments of every other frame handler as JSON slots. The sequence
+    # counter at its start makes it a seqlock, odd while a write is in progress, a reader copies
+    # the block and tries again if the counter moved meanwhile.
+    SLOTS = ("on_get_dongle_info_handler", "on_info_handler", "on_info_handler:BAL3", "on_status_handler",
+             "on_pack_stats_handler", "on_alarm_handler", "on_latency_handler", "on_metrics_handler",
+             "on_devices_handler", "on_timeout_handler", "on_port_disconnect", "on_no_device_found",
+             "on_connect_failed", "on_cells_handler")
+    SLOT_SIZE = 16 * 1024
+    # version, payload length
+    SLOT_HEADER = struct.Struct("<QI")
+    READ_RETRIES = 100
+
+    def __init__(self, cells:int, name:str=None):
+        self.cells = cells
+        # seq, then version, v and t of every cell, then the slots
+        self.__slots_offset = 8 + cells * 3 * 8
+        size = self.__slots_offset + len(self.SLOTS) * (self.SLOT_HEADER.size + self.SLOT_SIZE)
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+        self.name = self.shm.name
+        self.size = size
+        self.__owner = name is None
+        # slot writes refused for a payload over SLOT_SIZE, the UI keeps showing the previous one
+        self.dropped = 0
+        self.__seq = np.ndarray(1, np.uint64, self.shm.buf, 0)
+        self.versions, self.v, self.t = self.cells_of(self.shm.buf)
+        self.__lock = threading.Lock()
+
+    def cells_of(self, data) -> tuple:
+        # -> (versions, v, t) views of the cell arrays in the block or in a copy of it
+        return tuple(np.ndarray(self.cells, np.uint64 if i == 0 else np.int64, data, 8 + i * self.cells * 8)
+                     for i in range(3))
+
+    def __slot_offset(self, slot:str) -> int:
+        return self.__slots_offset + self.SLOTS.index(slot) * (self.SLOT_HEADER.size + self.SLOT_SIZE)
+
+    @contextmanager
+    def __write(self):
+        # the device threads of the acquisition process take turns, the seqlock has one writer
+        with self.__lock:
+            self.__seq[0] += 1
+            try:
+                yield
+            finally:
+                self.__seq[0] += 1
+
+    def write_cell(self, cell:int, v:int, t:int):
+        if not 0 <= cell < self.cells:
+            return
+        with self.__write():
+            self.v[cell] = v
+            self.t[cell] = t
+            self.versions[cell] = self.__seq[0]
+
+    def write_slot(self, slot:str, args:tuple) -> bool:
+        payload = json.dumps(args, separators=(",", ":"), default=_to_json).encode("utf-8")
+        if len(payload) > self.SLOT_SIZE:
+            with self.__lock:
+                self.dropped += 1
+            return False
+        offset = self.__slot_offset(slot)
+        with self.__write():
+            version, _ = self.SLOT_HEADER.unpack_from(self.shm.buf, offset)
+            self.SLOT_HEADER.pack_into(self.shm.buf, offset, version + 1, len(payload))
+            start = offset + self.SLOT_HEADER.size
+            self.shm.buf[start:start + len(payload)] = payload
+        return True
+
+    @property
+    def seq(self) -> int:
+        return int(self.__seq[0])
+
+    def read(self) -> tuple:
+        # -> (seq, consistent copy of the block), (None, None) if the writer kept it busy
+        for _ in range(self.READ_RETRIES):
+            seq = int(self.__seq[0])
+            if seq % 2 == 0:
+                data = bytes(self.shm.buf[:self.size])
+                if int(self.__seq[0]) == seq:
+                    return seq, data
+            time.sleep(0)
+        return None, None
+
+    def slot_of(self, data:bytes, slot:str) -> tuple:
+        # -> (version, args) of a slot in a copy of the block, version 0 was never written
+        offset = self.__slot_offset(slot)
+        version, length = self.SLOT_HEADER.unpack_from(data, offset)
+        if not version:
+            return 0, None
+        start = offset + self.SLOT_HEADER.size
+        return version, json.loads(data[start:start + length].decode("utf-8"))
+
+    def close(self):
+        self.__seq = self.versions = self.v = self.t = None
+        self.shm.close()
+        if self.__owner:
+            self.shm.unlink()
+
+
+class SharedRing:
+    # Trace bytes of the acquisition process: the count of bytes written so far followed by the
+    # ring. The writer stores the data before it moves the count on, a reader that fell more than
+    # a ring behind skips ahead and loses the overwritten part.
+    DEFAULT_SIZE = 4 * 1024 * 1024
+    HEADER = 8
+
+    def __init__(self, size:int=DEFAULT_SIZE, name:str=None):
+        self.size = size
+        self.shm = shared_memory.SharedMemory(name=name, create=name is None, size=self.HEADER + size)
+        self.name = self.shm.name
+        self.__owner = name is None
+        self.__total = np.ndarray(1, np.uint64, self.shm.buf, 0)
+        self.__lock = threading.Lock()
+
+    def write(self, data:bytes):
+        with self.__lock:
+            total = int(self.__total[0])
+            start = total + max(len(data) - self.size, 0)
+            data = data[-self.size:]
+            pos = start % self.size
+            first = min(len(data), self.size - pos)
+            self.shm.buf[self.HEADER + pos:self.HEADER + pos + first] = data[:first]
+            self.shm.buf[self.HEADER:self.HEADER + len(data) - first] = data[first:]
+            self.__total[0] = start + len(data)
+
+    def read(self, position:int) -> tuple:
+        # -> (new position, bytes since position, count of bytes lost)
+        total = int(self.__total[0])
+        position = min(position, total)
+        lost = max(total - position - self.size, 0)
+        position += lost
+        pos = position % self.size
+        length = total - position
+        first = min(length, self.size - pos)
+        data = bytes(self.shm.buf[self.HEADER + pos:self.HEADER + pos + first]) + \
+               bytes(self.shm.buf[self.HEADER:self.HEADER + length - first])
+        # whatever the writer overwrote while it was copied is gone as well
+        overwritten = max(int(self.__total[0]) - self.size - position, 0)
+        return total, data[overwritten:], lost + min(overwritten, len(data))
+
+    def close(self):
+        self.__total = None
+        self.shm.close()
+        if self.__owner:
+            self.shm.unlink()
+
+
+class StatePublisher:
+    # The frame handlers of the acquisition process: what the dongle reports for the selected
+    # device goes to the shared state, the trace to the ring.
+    def __init__(self, state:SharedState, ring:SharedRing):
+        self.state = state
+        self.ring = ring
+        self.callbacks = {name: self.__slot_writer(name) for name in SharedState.SLOTS if ":" not in name}
+        self.callbacks.update({
+            "on_info_handler": self.on_info_handler,
+            "on_status_handler": self.on_status_handler,
+            "on_trace_handler": self.on_trace_handler,
+        })
+
+    def __slot_writer(self, slot:str):
+        return lambda *args: self.state.write_slot(slot, args)
+
+    def on_info_handler(self, data:dict):
+        self.state.write_slot("on_info_handler:BAL3" if data.get("name") == "BAL3" else "on_info_handler", (data,))
+
+    def on_status_handler(self, data:dict):
+        if "id" in data:
+            self.state.write_cell(data["id"], data["v"], data["t"])
+        else:
+            self.state.write_slot("on_status_handler", (data,))
+
+    def on_trace_handler(self, trace:str):
+        if trace:
+            self.ring.write(trace.encode("utf-8"))
+
+
+class RemoteDongle:
+    # Stands in for ConsoleDongle in the UI process: the dongle itself runs in the acquisition
+    # process. Once a render tick poll() reads the shared state and calls the frame handlers for
+    # what changed, commands from the frames go to the acquisition process over a pipe.
+    REPLY_TIMEOUT = 2.0
+    STOP_TIMEOUT = 5.0
+
+    def __init__(self, cells:int, target, args, trace_log:TraceLog, trace_path:str,
+                 ring_size:int=SharedRing.DEFAULT_SIZE, cell_count:int=16):
+        import multiprocessing
+        self.state = SharedState(cells)
+        self.ring = SharedRing(ring_size)
+        self.trace_log = trace_log
+        self.trace_path = trace_path
+        # render and apply timings of the UI, merged into the metrics of the acquisition process
+        self.metrics = Metrics()
+        self.trace_lost = 0
+        # cells of the selected device, the shared state has room for up to cells of them
+        self.cell_count = cell_count
+        self.__ui_metrics = None
+        self.__seq = 0
+        self.__versions = np.zeros(cells, dtype=np.uint64)
+        self.__slot_versions = dict.fromkeys(SharedState.SLOTS, 0)
+        self.__devices = []
+        self.__position = 0
+        self.__decoder = TraceDecoder()
+        context = multiprocessing.get_context("spawn")
+        self.__conn, child_conn = context.Pipe()
+        self.process = context.Process(target=target, args=(args, self.state.name, self.ring.name, ring_size, child_conn),
+                                       name="acquisition", daemon=True)
+        self.callbacks = {
+            "trace_ctrl": lambda state: self.__command("trace_ctrl", state),
+            "bal_trace_ctrl": lambda state: self.__command("bal_trace_ctrl", state),
+            "select_device": lambda target: self.__command("select_device", target),
+            "update_port_info": lambda: self.__command("update_port_info"),
+            "on_clear_log": self.__on_clear_log,
+            "save_trace": self.save_trace,
+            "get_trace_log": self.trace_log.text,
+            "get_trace_store": lambda: self.trace_log,
+            "get_trace_path": lambda: self.trace_path,
+            "get_devices_overview": lambda: self.__devices,
+            "get_cells": lambda: self.cell_count,
+        }
+
+    def start(self):
+        self.process.start()
+
+    def __command(self, name:str, *args):
+        try:
+            self.__conn.send((name, args))
+        except (OSError, ValueError):
+            pass
+
+    def save_trace(self, path:str) -> bool:
+        self.__command("save_trace", path)
+        try:
+            return self.__conn.poll(self.REPLY_TIMEOUT) and self.__conn.recv()
+        except (OSError, EOFError):
+            return False
+
+    def __on_clear_log(self):
+        self.trace_log.clear()
+        self.__command("on_clear_log")
+
+    def poll(self):
+        self.__poll_trace()
+        if self.state.seq == self.__seq:
+            return
+        seq, data = self.state.read()
+        if data is None:
+            return
+        self.__seq = seq
+        for slot in SharedState.SLOTS:
+            version, args = self.state.slot_of(data, slot)
+            if version != self.__slot_versions[slot]:
+                self.__slot_versions[slot] = version
+                self.__dispatch(slot.split(":")[0], args)
+        versions, v, t = self.state.cells_of(data)
+        for cell in np.nonzero(versions != self.__versions)[0]:
+            self.__call("on_status_handler", {"id": int(cell), "v": int(v[cell]), "t": int(t[cell])})
+        self.__versions = versions.copy()
+
+    def __dispatch(self, handler:str, args:list):
+        if handler == "on_alarm_handler":
+            args[0] = np.array(args[0], dtype=bool)
+        elif handler == "on_devices_handler":
+            self.__devices = args[0]
+        elif handler == "on_cells_handler":
+            self.cell_count = args[0]
+        elif handler == "on_metrics_handler":
+            args[0] = self.__merge_metrics(args[0])
+        self.__call(handler, *args)
+        if handler == "on_status_handler" and "flags" in args[0]:
+            self.__call("on_flag_handler", *args)
+
+    def __merge_metrics(self, snapshot:dict) -> dict:
+        ui = with_rates(self.metrics.snapshot(), self.__ui_metrics)
+        self.__ui_metrics = ui
+        snapshot["timings"].update(ui["timings"])
+        snapshot["means"].update(ui["means"])
+        snapshot["counters"]["trace_lost"] = self.trace_lost
+        return snapshot
+
+    def __call(self, handler:str, *args):
+        if handler in self.callbacks:
+            self.callbacks[handler](*args)
+
+    def __poll_trace(self):
+        position, data, lost = self.ring.read(self.__position)
+        self.__position = position
+        self.trace_lost += lost
+        if data:
+            # a chunk cut by the ring may end inside a character, the decoder keeps it for the next one
+            trace = self.__decoder.decode(data)
+            self.trace_log.append(trace)
+            self.__call("on_trace_handler", trace)
+
+    def stop_threads(self):
+        self.__command("stop")
+        self.process.join(self.STOP_TIMEOUT)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.__conn.close()
+        self.state.close()
+        self.ring.close()
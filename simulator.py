@@ -0,0 +1,154 @@
+import random, threading, time
+
+from sources import DeviceSource
+from capture import KIND_STATUS, KIND_TRACE
+
+
+class SimulatedDevice:
+    NOMINAL_MV = 3300
+
+    def __init__(self, serial:int, cells:int, bal_serial:int=0):
+        self.serial = serial
+        self.subnet_device = SimulatedDevice(bal_serial, 0) if bal_serial else None
+        self.v = [self.NOMINAL_MV + random.randrange(-30, 30) for _ in range(cells)]
+        self.t = [random.randrange(20, 30) for _ in range(cells)]
+        # one cell per pack drifts away from the others
+        self.drift = [0] * cells
+        if cells:
+            self.drift[random.randrange(cells)] = random.choice((-1, 1))
+        self.flags = 0
+        self.curr = 0
+        self.soc = 50
+        self.trace_on = False
+        self.bal_trace_on = False
+        self.trace_seq = 0
+
+    def step(self):
+        for i in range(len(self.v)):
+            self.v[i] = min(max(self.v[i] + random.randrange(-2, 3) + self.drift[i], 2500), 4200)
+            self.t[i] = min(max(self.t[i] + random.randrange(-1, 2), 10), 60)
+        self.curr = random.randrange(-5000, 5000)
+        self.flags ^= 1 << random.randrange(32) if random.random() < 0.05 else 0
+
+    def cell(self, i:int) -> dict:
+        return {"id": i, "v": self.v[i], "t": self.t[i]}
+
+    def status(self) -> dict:
+        return {"flags": self.flags, "qty": len(self.v), "vpack": sum(self.v), "curr": self.curr, "soc": self.soc}
+
+
+class SimulatedSource(DeviceSource):
+    DEFAULT_CELLS = 16
+    DEFAULT_TIMEOUT = 0.5
+    TRACE_LINE_BYTES = 64
+
+    def __init__(self, cells:int=DEFAULT_CELLS, devices:int=1, status_hz:float=0.0, trace_hz:float=0.0,
+                 latency:float=0.0, timeout_rate:float=0.0, timeout:float=DEFAULT_TIMEOUT, seed:int=None):
+        super().__init__("SIMULATOR", can_adapter=devices > 1)
+        if seed is not None:
+            random.seed(seed)
+        self.cells = cells
+        # unsolicited full status cycles / trace lines per second and device, 0 = only answer polls
+        self.status_hz = status_hz
+        self.trace_hz = trace_hz
+        self.latency = latency
+        self.timeout_rate = timeout_rate
+        self.timeout = timeout
+        self.devices = [SimulatedDevice(0x1000 + i, cells, 0x2000 + i) for i in range(devices)]
+        self.__stop = threading.Event()
+        self.__threads = []
+        if status_hz:
+            self.__threads.append(threading.Thread(target=self.__push_status, name="sim_status", daemon=True))
+        if trace_hz:
+            self.__threads.append(threading.Thread(target=self.__push_trace, name="sim_trace", daemon=True))
+
+    def get_devlist(self) -> list:
+        return self.devices if self.can_adapter else None
+
+    def __device(self, channel) -> SimulatedDevice:
+        for device in self.devices:
+            if device.serial == channel:
+                return device
+        return self.devices[0] if channel is None else None
+
+    def send_data_to_port(self, data, channel=None, flags=None):
+        device = self.__device(channel)
+        if self.latency:
+            time.sleep(random.uniform(0.5, 1.5) * self.latency)
+        if self.__times_out(device, data):
+            self.__stop.wait(self.timeout)
+            return 1
+        return self.__answer(device, data)
+
+    async def send_async(self, data, channel=None, flags=None):
+        # only the asyncio engine gets here, don't load asyncio for everybody else
+        import asyncio
+        device = self.__device(channel)
+        if self.latency:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        if self.__times_out(device, data):
+            await asyncio.sleep(self.timeout)
+            return 1
+        return self.__answer(device, data)
+
+    def __times_out(self, device:SimulatedDevice, data) -> bool:
+        if device is None or random.random() < self.timeout_rate:
+            return True
+        return data[0] == "status" and len(data) > 1 and not 0 <= data[1]["id"] < self.cells
+
+    def __answer(self, device:SimulatedDevice, data) -> int:
+        command = data[0]
+        if command == "status" and len(data) > 1:
+            self.get_device_status_handler(device.cell(data[1]["id"]))
+        elif command == "status":
+            device.step()
+            self.get_device_status_handler(device.status())
+        elif command == "info":
+            self.get_device_info_handler({"name": "BMS3", "hwver": "sim", "fwver": "sim"})
+        elif command == "infobal":
+            self.get_device_info_handler({"name": "BAL3", "hwver": "sim", "fwver": "sim"})
+        elif command == "trace":
+            device.trace_on = data[1].get("on", device.trace_on)
+            device.bal_trace_on = data[1].get("bal", device.bal_trace_on)
+        return 0
+
+    def start_threads(self):
+        for thread in self.__threads:
+            thread.start()
+
+    def stop_threads(self):
+        self.__stop.set()
+        for thread in self.__threads:
+            thread.join()
+
+    def __every(self, hz:float):
+        # yields at hz without drifting, gives up when stopped
+        period = 1.0 / hz
+        next_due = time.monotonic()
+        while not self.__stop.is_set():
+            yield
+            next_due = max(next_due + period, time.monotonic() - period)
+            pause = next_due - time.monotonic()
+            if pause > 0 and self.__stop.wait(pause):
+                return
+
+    def __push_status(self):
+        for _ in self.__every(self.status_hz):
+            for device in self.devices:
+                target = device.serial if self.can_adapter else None
+                device.step()
+                if self.dongle:
+                    self.dongle.on_device_event(KIND_STATUS, target, device.status())
+                    for i in range(self.cells):
+                        self.dongle.on_device_event(KIND_STATUS, target, device.cell(i))
+
+    def __push_trace(self):
+        for _ in self.__every(self.trace_hz):
+            for device in self.devices:
+                for source, on in (("BMS", device.trace_on), ("BAL", device.bal_trace_on)):
+                    if not on or not self.dongle:
+                        continue
+                    device.trace_seq += 1
+                    line = f"{source} {device.serial:x} #{device.trace_seq} I={device.curr} "
+                    line = line.ljust(self.TRACE_LINE_BYTES - 2, "-") + "\r\n"
+                    self.dongle.on_device_event(KIND_TRACE, None, {"s": line.encode("utf-8")})
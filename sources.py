@@ -0,0 +1,96 @@
+import threading
+
+
+class DeviceSource:
+    # Where ConsoleDongle gets its device traffic from. A source answers the requests passed to
+    # send_data_to_port (non zero return value means timeout) by calling the get_*_handler
+    # methods, which forward to the dongle. Traffic with a known sender can also be pushed
+    # with dongle.on_device_event(). A source that can answer without blocking a thread also
+    # provides an async send_async(data, channel, flags) coroutine for the asyncio engine.
+    POLLED = True
+
+    def __init__(self, serial_port:str, can_adapter:bool=False):
+        self.serial_port = serial_port
+        self.can_adapter = can_adapter
+        self.dongle = None
+
+    def is_open(self):
+        return self.serial_port
+
+    def enumeration(self, full:bool):
+        pass
+
+    def get_devlist(self) -> list:
+        return None
+
+    def send_data_to_port(self, data, channel=None, flags=None):
+        return 0
+
+    def start_threads(self):
+        pass
+
+    def stop_threads(self):
+        pass
+
+    def get_device_info_handler(self, data):
+        if self.dongle:
+            self.dongle.get_device_info_handler(data)
+
+    def get_device_status_handler(self, data):
+        if self.dongle:
+            self.dongle.get_device_status_handler(data)
+
+    def get_trace_handler(self, data):
+        if self.dongle:
+            self.dongle.get_trace_handler(data)
+
+
+class PendingSource(DeviceSource):
+    # stands in for the source while it is opened in the background, nothing to poll yet
+    def is_open(self):
+        return None
+
+
+class SourceOpener(threading.Thread):
+    # Opens a source (port and CAN enumeration, capture index) off the UI thread. A blocking open
+    # can't be interrupted, after the deadline it is given up and left to finish on its own. A
+    # deadline of None waits for as long as the open takes.
+    DEFAULT_DEADLINE = 5.0
+
+    def __init__(self, open_source, deadline:float=DEFAULT_DEADLINE, on_open=None, on_error=None):
+        super().__init__(group=None, name="source_opener", daemon=True)
+        self.open_source = open_source
+        self.deadline = deadline
+        self.on_open = on_open
+        self.on_error = on_error
+        self.source = None
+        self.error = None
+
+    def run(self):
+        opened = {}
+
+        def open_source():
+            try:
+                opened["source"] = self.open_source()
+            except (OSError, ValueError) as e:
+                opened["error"] = str(e)
+            except Exception as e:
+                # whatever the device library raises, the UI must hear about it instead of waiting forever
+                opened["error"] = f"{type(e).__name__}: {e}"
+
+        opener = threading.Thread(target=open_source, name="source_open", daemon=True)
+        opener.start()
+        opener.join(self.deadline)
+        if opener.is_alive():
+            self.error = f"no answer within {self.deadline:g} s"
+        elif "error" in opened:
+            self.error = opened["error"]
+        elif not opened["source"].is_open():
+            self.error = "port is busy or wrong"
+        else:
+            self.source = opened["source"]
+        if self.source:
+            if self.on_open:
+                self.on_open(self.source)
+        elif self.on_error:
+            self.on_error(self.error)
@@ -0,0 +1,90 @@
+import threading, time
+
+import numpy as np
+
+
+class CellHistory:
+    DEFAULT_DEPTH = 3600
+    # samples per cell the dV/dt slope is fitted over
+    SLOPE_SAMPLES = 10
+
+    def __init__(self, cells:int=16, depth:int=DEFAULT_DEPTH):
+        self.cells = cells
+        self.depth = depth
+        # ring per cell: row = cell id, column = sample slot, voltages in mV
+        self.v = np.full((cells, depth), np.nan, dtype=np.float32)
+        self.t = np.full((cells, depth), np.nan, dtype=np.float32)
+        self.ts = np.full((cells, depth), np.nan, dtype=np.float64)
+        # slot of the latest sample of every cell, -1 before the first one
+        self.head = np.full(cells, -1, dtype=np.int64)
+        self.samples = np.zeros(cells, dtype=np.int64)
+        self.__rows = np.arange(cells)
+        self.__lock = threading.Lock()
+
+    def add(self, cell:int, v:float, t:float, ts:float=None):
+        if not 0 <= cell < self.cells:
+            return
+        with self.__lock:
+            slot = (self.head[cell] + 1) % self.depth
+            self.v[cell, slot] = v
+            self.t[cell, slot] = t
+            self.ts[cell, slot] = time.time() if ts is None else ts
+            self.head[cell] = slot
+            self.samples[cell] += 1
+
+    def clear(self):
+        with self.__lock:
+            self.v.fill(np.nan)
+            self.t.fill(np.nan)
+            self.ts.fill(np.nan)
+            self.head.fill(-1)
+            self.samples.fill(0)
+
+    def latest(self) -> tuple:
+        # -> (voltages mV, temperatures), NaN for cells without samples
+        with self.__lock:
+            valid = self.head >= 0
+            slots = np.where(valid, self.head, 0)
+            v = np.where(valid, self.v[self.__rows, slots], np.nan)
+            t = np.where(valid, self.t[self.__rows, slots], np.nan)
+        return v, t
+
+    def dvdt(self) -> np.ndarray:
+        # least squares slope over the last SLOPE_SAMPLES samples of every cell, mV/s
+        n = min(self.SLOPE_SAMPLES, self.depth)
+        with self.__lock:
+            slots = (self.head[:, None] - np.arange(n)[None, :]) % self.depth
+            v = self.v[self.__rows[:, None], slots].astype(np.float64)
+            ts = self.ts[self.__rows[:, None], slots]
+        mask = ~(np.isnan(v) | np.isnan(ts))
+        count = mask.sum(axis=1)
+        ts = np.where(mask, ts, 0.0)
+        v = np.where(mask, v, 0.0)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            ts_mean = ts.sum(axis=1) / count
+            v_mean = v.sum(axis=1) / count
+            dts = np.where(mask, ts - ts_mean[:, None], 0.0)
+            dv = np.where(mask, v - v_mean[:, None], 0.0)
+            slope = (dts * dv).sum(axis=1) / (dts * dts).sum(axis=1)
+        return np.where(count >= 2, slope, np.nan)
+
+    def stats(self) -> dict:
+        v, t = self.latest()
+        if np.isnan(v).all():
+            return None
+        dvdt = self.dvdt()
+        # the drifting cell is the one whose slope is furthest from the rest of the pack
+        drift = np.abs(dvdt - np.nanmedian(dvdt)) if not np.isnan(dvdt).all() else dvdt
+        drift_cell = int(np.nanargmax(drift)) if not np.isnan(drift).all() else None
+        return {
+            "v_min": float(np.nanmin(v)) / 1000,
+            "v_max": float(np.nanmax(v)) / 1000,
+            "v_mean": float(np.nanmean(v)) / 1000,
+            "imbalance": float(np.nanmax(v) - np.nanmin(v)) / 1000,
+            "v_min_cell": int(np.nanargmin(v)),
+            "v_max_cell": int(np.nanargmax(v)),
+            "t_max": float(np.nanmax(t)) if not np.isnan(t).all() else None,
+            "dvdt": dvdt,
+            "drift_cell": drift_cell,
+            "drift": float(dvdt[drift_cell]) if drift_cell is not None else None,
+        }
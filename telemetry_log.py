@@ -0,0 +1,186 @@
+import os, csv, threading, time
+
+
+def parquet_available() -> bool:
+    try:
+        import pyarrow.parquet
+        return True
+    except ImportError:
+        return False
+
+
+class TelemetryWriter(threading.Thread):
+    # Status rows of the devices are buffered column by column and written in batches on this
+    # thread, recording a row costs the device thread a few list appends. Parquet is written when
+    # pyarrow is installed, CSV otherwise.
+    DEFAULT_BATCH_ROWS = 1000
+    DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+    DEFAULT_BACKUPS = 5
+    DEFAULT_CELLS = 16
+    FLUSH_INTERVAL = 5.0
+    # rows are dropped instead of piling up when the disk doesn't keep up
+    MAX_PENDING_ROWS = 100000
+    BUFFER_SIZE = 256 * 1024
+    STATUS_COLUMNS = ("curr", "soc", "flags")
+
+    def __init__(self, path:str, cells:int=None, fmt:str=None, period:float=0.0, decimate:int=1,
+                 batch_rows:int=DEFAULT_BATCH_ROWS, max_size:int=DEFAULT_MAX_SIZE, max_age:float=None,
+                 backups:int=DEFAULT_BACKUPS):
+        super().__init__(group=None, name="telemetry_writer", daemon=True)
+        if fmt is None:
+            fmt = "parquet" if path.endswith(".parquet") else "csv"
+        if fmt == "parquet" and not parquet_available():
+            # no pyarrow: keep logging, as CSV under a name that says so
+            fmt = "csv"
+            path = os.path.splitext(path)[0] + ".csv"
+        self.path = path
+        self.fmt = fmt
+        # cell columns of every row, None takes the count the first status reports, the file keeps it
+        self.cells = cells
+        # at most one row per device and period, and only every decimate-th status cycle
+        self.period = period
+        self.decimate = max(decimate, 1)
+        self.batch_rows = batch_rows
+        self.max_size = max_size
+        self.max_age = max_age
+        self.backups = backups
+        self.columns = None
+        self.error = None
+        self.rows = 0
+        self.dropped = 0
+        self.__buffer = None
+        if cells:
+            self.__set_cells(cells)
+        self.__pending = 0
+        # bms_id -> (status cycles seen, time of the last row kept)
+        self.__seen = {}
+        self.__lock = threading.Lock()
+        self.__wake = threading.Event()
+        self.__file = None
+        self.__writer = None
+
+    def __set_cells(self, cells:int):
+        self.cells = cells
+        self.columns = ["ts", "bms_id"] + list(self.STATUS_COLUMNS) + \
+                       [f"v{i + 1}" for i in range(cells)] + [f"t{i + 1}" for i in range(cells)]
+        self.__buffer = self.__new_buffer()
+
+    def __new_buffer(self) -> list:
+        return [[] for _ in self.columns]
+
+    def record(self, bms_id:int, status:dict, cells:dict, ts:float=None):
+        ts = time.time() if ts is None else ts
+        seen, last = self.__seen.get(bms_id, (0, None))
+        keep = seen % self.decimate == 0 and (last is None or ts - last >= self.period)
+        self.__seen[bms_id] = (seen + 1, ts if keep else last)
+        if not keep:
+            return
+        with self.__lock:
+            if self.columns is None:
+                self.__set_cells(status.get("qty") or self.DEFAULT_CELLS)
+            if self.__pending >= self.MAX_PENDING_ROWS:
+                self.dropped += 1
+                return
+            buffer = self.__buffer
+            buffer[0].append(ts)
+            buffer[1].append(bms_id)
+            for i, name in enumerate(self.STATUS_COLUMNS, 2):
+                buffer[i].append(status.get(name))
+            first = 2 + len(self.STATUS_COLUMNS)
+            for i in range(self.cells):
+                cell = cells.get(i)
+                buffer[first + i].append(cell["v"] if cell else None)
+                buffer[first + self.cells + i].append(cell["t"] if cell else None)
+            self.__pending += 1
+            if self.__pending >= self.batch_rows:
+                self.__wake.set()
+
+    def stop(self):
+        self.do_run = False
+        self.__wake.set()
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        t = threading.current_thread()
+        while getattr(t, "do_run", True):
+            self.__wake.wait(self.FLUSH_INTERVAL)
+            self.__wake.clear()
+            self.__flush()
+        self.__flush()
+        self.__close()
+
+    def __flush(self):
+        with self.__lock:
+            if self.columns is None:
+                return
+            buffer, self.__buffer = self.__buffer, self.__new_buffer()
+            rows, self.__pending = self.__pending, 0
+        if not rows:
+            return
+        try:
+            if self.__file is None:
+                self.__open()
+            elif self.__need_rotation():
+                self.__rotate()
+            if self.fmt == "parquet":
+                import pyarrow
+                self.__writer.write_table(pyarrow.table(dict(zip(self.columns, buffer)), schema=self.__writer.schema))
+            else:
+                self.__writer.writerows(zip(*buffer))
+                self.__file.flush()
+            self.rows += rows
+            self.error = None
+        except (OSError, ValueError) as e:
+            self.error = e
+            self.__close()
+
+    def __need_rotation(self) -> bool:
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if self.max_size and size > self.max_size:
+            return True
+        return bool(self.max_age and time.time() - self.__opened > self.max_age and size)
+
+    def __open(self):
+        new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        if self.fmt == "parquet":
+            import pyarrow, pyarrow.parquet
+            # a parquet file can't be appended to, the one left from a previous run is rotated
+            if not new_file:
+                self.__shift_backups()
+            schema = pyarrow.schema([("ts", pyarrow.float64())] +
+                                    [(name, pyarrow.int64()) for name in self.columns[1:]])
+            self.__file = open(self.path, "wb")
+            self.__writer = pyarrow.parquet.ParquetWriter(self.__file, schema)
+        else:
+            self.__file = open(self.path, "a", buffering=self.BUFFER_SIZE, newline="")
+            self.__writer = csv.writer(self.__file)
+            if new_file:
+                self.__writer.writerow(self.columns)
+        self.__opened = time.time()
+
+    def __close(self):
+        try:
+            if self.fmt == "parquet" and self.__writer:
+                self.__writer.close()
+            if self.__file:
+                self.__file.close()
+        except (OSError, ValueError) as e:
+            self.error = e
+        self.__file = None
+        self.__writer = None
+
+    def __backup_name(self, i:int) -> str:
+        root, ext = os.path.splitext(self.path)
+        return f"{root}.{i}{ext}"
+
+    def __shift_backups(self):
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(self.__backup_name(i)):
+                os.replace(self.__backup_name(i), self.__backup_name(i + 1))
+        os.replace(self.path, self.__backup_name(1))
+
+    def __rotate(self):
+        self.__close()
+        self.__shift_backups()
+        self.__open()
@@ -0,0 +1,108 @@
+import numpy as np
+
+from alarms import AlarmEngine, OV, UV, OT, IMBALANCE
+
+
+def cells(v, count:int=4, t:float=25):
+    return np.full(count, v, dtype=np.float64), np.full(count, t, dtype=np.float64)
+
+
+def run(engine, cycles:int, v, t) -> list:
+    events = []
+    for i in range(cycles):
+        events += engine.evaluate(1, v, t, ts=float(i))
+    return events
+
+
+def test_raised_only_after_debounce():
+    engine = AlarmEngine(debounce=3)
+    v, t = cells(3700)
+    v[1] = 4300
+    assert engine.evaluate(1, v, t) == []
+    assert engine.evaluate(1, v, t) == []
+    events = engine.evaluate(1, v, t)
+    # 600 mV over the others is an imbalance as well
+    assert [(e.rule, e.cell, e.value, e.raised) for e in events] == [("OV", 1, 4300, True), ("IMBALANCE", 1, 600, True)]
+    assert engine.active(1)[OV].tolist() == [False, True, False, False]
+    assert engine.summary(1) == "OV: 2 | IMBALANCE: 2"
+
+
+def test_a_short_spike_is_ignored():
+    engine = AlarmEngine(debounce=3)
+    normal = cells(3700)
+    spike = cells(4300)
+    for _ in range(5):
+        assert run(engine, 2, *spike) == []
+        assert run(engine, 1, *normal) == []
+    assert not engine.active(1).any()
+
+
+def test_cleared_only_past_the_hysteresis_band():
+    engine = AlarmEngine(ov=4250, hysteresis_v=20, debounce=1)
+    assert run(engine, 1, *cells(4260))[0].raised
+    # under the limit but inside the band: still active
+    assert run(engine, 5, *cells(4240)) == []
+    assert engine.active(1)[OV].all()
+    events = run(engine, 1, *cells(4230))
+    assert len(events) == 4 and not any(e.raised for e in events)
+    assert not engine.active(1).any()
+
+
+def test_under_voltage_and_temperature():
+    engine = AlarmEngine(debounce=1)
+    v, t = cells(3700)
+    v[0] = 2700
+    t[3] = 60
+    engine.evaluate(1, v, t)
+    active = engine.active(1)
+    assert active[UV].tolist() == [True, False, False, False]
+    assert active[OT].tolist() == [False, False, False, True]
+    # the UV band is above the limit
+    v[0] = 2810
+    t[3] = 54
+    assert engine.evaluate(1, v, t) == []
+    v[0] = 2830
+    t[3] = 52
+    assert {(e.rule, e.raised) for e in engine.evaluate(1, v, t)} == {("UV", False), ("OT", False)}
+
+
+def test_imbalance_against_the_lowest_cell():
+    engine = AlarmEngine(imbalance=50, debounce=1)
+    v, t = cells(3700)
+    v[2] = 3760
+    events = engine.evaluate(1, v, t)
+    assert [(e.rule, e.cell, e.value) for e in events] == [("IMBALANCE", 2, 60)]
+
+
+def test_missing_cells_keep_their_state():
+    engine = AlarmEngine(debounce=1)
+    v, t = cells(4300)
+    engine.evaluate(1, v, t)
+    v[:] = np.nan
+    t[:] = np.nan
+    assert engine.evaluate(1, v, t) == []
+    assert engine.active(1)[OV].all()
+
+
+def test_devices_and_cell_counts_are_separate():
+    engine = AlarmEngine(cells=4, debounce=1)
+    engine.evaluate(1, *cells(4300))
+    assert not engine.active(2).any()
+    assert engine.active(2).shape == (4, 4)
+    # another cell count starts the device over
+    assert len(engine.evaluate(1, *cells(4300, count=8))) == 8
+    engine.forget(1)
+    assert not engine.active(1).any()
+
+
+def test_log_file(tmp_path):
+    path = tmp_path / "alarms.log"
+    engine = AlarmEngine(debounce=1, log_path=str(path))
+    engine.start()
+    engine.evaluate(0x1234, *cells(4300, count=1))
+    engine.evaluate(0x1234, *cells(3700, count=1))
+    engine.stop()
+    lines = path.read_text().splitlines()
+    assert len(lines) == 2
+    assert lines[0].endswith("0x1234 OV cell 1: 4300 RAISED")
+    assert lines[1].endswith("0x1234 OV cell 1: 3700 cleared")
@@ -0,0 +1,101 @@
+import threading
+
+import pytest
+
+from capture import MAGIC, KIND_STATUS, KIND_INFO, KIND_TRACE, KIND_CELL, RECORD_HEADER, CaptureWriter, \
+    CaptureReader, ReplaySource, encode_record, decode_payload
+
+RECORDS = [
+    (KIND_INFO, None, {"name": "BMS3", "fw": "1.2"}),
+    (KIND_STATUS, 101, {"id": 0, "v": 3312, "t": 24}),
+    (KIND_STATUS, 102, {"id": 1, "v": -1, "t": -40}),
+    (KIND_STATUS, 101, {"flags": 5, "soc": 80}),
+    (KIND_TRACE, None, {"s": "BMS ΔV\r\n".encode("utf-8")}),
+]
+
+
+def write_capture(path, records=RECORDS) -> str:
+    writer = CaptureWriter(str(path))
+    writer.start()
+    for kind, target, data in records:
+        writer.record(kind, target, data)
+    writer.stop()
+    assert writer.error is None
+    assert writer.records == len(records)
+    return str(path)
+
+
+def test_cells_are_packed():
+    record = encode_record(KIND_STATUS, 7, {"id": 3, "v": 3300, "t": 25}, ts=1.5)
+    length, ts, kind, target = RECORD_HEADER.unpack_from(record)
+    assert (length, ts, kind, target) == (10, 1.5, KIND_CELL, 7)
+    assert decode_payload(kind, record[RECORD_HEADER.size:]) == (KIND_STATUS, {"id": 3, "v": 3300, "t": 25})
+    # anything else in a status frame keeps it json
+    record = encode_record(KIND_STATUS, None, {"id": 3, "v": 3300, "t": 25.5})
+    assert RECORD_HEADER.unpack_from(record)[2] == KIND_STATUS
+
+
+def test_round_trip(tmp_path):
+    path = write_capture(tmp_path / "a.cap")
+    reader = CaptureReader(path)
+    records = [(kind, target, data) for _, kind, target, data in reader]
+    reader.close()
+    assert records == RECORDS
+
+
+def test_appending_keeps_one_magic(tmp_path):
+    path = write_capture(tmp_path / "a.cap")
+    write_capture(tmp_path / "a.cap")
+    with open(path, "rb") as f:
+        assert f.read().count(MAGIC) == 1
+    reader = CaptureReader(path)
+    assert len(list(reader)) == 2 * len(RECORDS)
+    reader.close()
+
+
+def test_targets_in_order_of_appearance(tmp_path):
+    reader = CaptureReader(write_capture(tmp_path / "a.cap"))
+    assert reader.targets() == [None, 101, 102]
+    reader.close()
+
+
+def test_cut_off_record_is_ignored(tmp_path):
+    path = write_capture(tmp_path / "a.cap")
+    with open(path, "r+b") as f:
+        f.truncate(f.seek(0, 2) - 3)
+    reader = CaptureReader(path)
+    assert [data for _, _, _, data in reader] == [data for _, _, data in RECORDS[:-1]]
+    assert reader.targets() == [None, 101, 102]
+    reader.close()
+
+
+def test_empty_and_foreign_files(tmp_path):
+    empty = tmp_path / "empty.cap"
+    empty.write_bytes(b"")
+    reader = CaptureReader(str(empty))
+    assert list(reader) == []
+    assert reader.targets() == []
+    reader.close()
+    foreign = tmp_path / "foreign.cap"
+    foreign.write_bytes(b"not a capture at all")
+    with pytest.raises(ValueError):
+        CaptureReader(str(foreign))
+
+
+class Recorder:
+    def __init__(self):
+        self.events = []
+
+    def on_device_event(self, kind, target, data):
+        self.events.append((kind, target, data))
+
+
+def test_replay_plays_every_record(tmp_path):
+    source = ReplaySource(write_capture(tmp_path / "a.cap"), speed=0)
+    assert source.can_adapter
+    assert [dev.serial for dev in source.get_devlist()] == [101, 102]
+    source.dongle = Recorder()
+    source.start_threads()
+    assert source.finished.wait(5)
+    source.stop_threads()
+    assert source.dongle.events == RECORDS
@@ -0,0 +1,222 @@
+import threading, time
+
+import pytest
+
+from scheduler import CommandQueue, PollTask, PollScheduler, InFlightWindow, LatencyHistogram, command_key
+
+
+def test_command_key_ignores_dict_order():
+    assert command_key(["status", {"id": 3, "x": 1}]) == command_key(["status", {"x": 1, "id": 3}])
+    assert command_key(["status", {"id": 3}]) != command_key(["status", {"id": 4}])
+
+
+def test_user_commands_go_before_polls():
+    q = CommandQueue()
+    q.put(["status"], CommandQueue.PRIORITY_POLL)
+    q.put(["info"], CommandQueue.PRIORITY_POLL)
+    q.put(["trace", {"on": True}])
+    assert [q.get(0)[0][0] for _ in range(3)] == ["trace", "status", "info"]
+
+
+def test_same_priority_keeps_order():
+    q = CommandQueue()
+    for i in range(5):
+        q.put(["status", {"id": i}], CommandQueue.PRIORITY_POLL)
+    assert [q.get(0)[0][1]["id"] for _ in range(5)] == list(range(5))
+
+
+def test_coalesce_drops_a_queued_duplicate():
+    q = CommandQueue()
+    assert q.put(["status"], CommandQueue.PRIORITY_POLL, coalesce=True)
+    assert not q.put(["status"], CommandQueue.PRIORITY_POLL, coalesce=True)
+    assert q.coalesced == 1
+    assert q.qsize() == 1
+    # once sent it may be queued again
+    assert q.get(0) == (["status"], None)
+    assert q.put(["status"], CommandQueue.PRIORITY_POLL, coalesce=True)
+
+
+def test_coalesce_is_per_target():
+    q = CommandQueue()
+    assert q.put(["status"], CommandQueue.PRIORITY_POLL, coalesce=True, target=1)
+    assert q.put(["status"], CommandQueue.PRIORITY_POLL, coalesce=True, target=2)
+    assert q.qsize() == 2
+    assert {q.get(0)[1], q.get(0)[1]} == {1, 2}
+
+
+def test_without_coalesce_duplicates_are_kept():
+    q = CommandQueue()
+    q.put(["status"])
+    q.put(["status"])
+    assert q.qsize() == 2
+    assert q.coalesced == 0
+
+
+def test_get_times_out_empty():
+    q = CommandQueue()
+    started = time.monotonic()
+    assert q.get(0.05) is None
+    assert time.monotonic() - started >= 0.04
+
+
+def test_get_wakes_on_put_and_close():
+    q = CommandQueue()
+    got = []
+    getter = threading.Thread(target=lambda: got.append(q.get(5)))
+    getter.start()
+    q.put(["info"], target=7)
+    getter.join(5)
+    assert got == [(["info"], 7)]
+    getter = threading.Thread(target=lambda: got.append(q.get(5)))
+    getter.start()
+    q.close()
+    getter.join(5)
+    assert not getter.is_alive()
+    assert got[-1] is None
+
+
+def make_poller(*tasks):
+    q = CommandQueue()
+    poller = PollScheduler(q)
+    for task in tasks:
+        poller.add(task)
+    return q, poller
+
+
+def test_info_backs_off_after_the_first_answer():
+    task = PollTask("info", lambda: [["info"]], 1.0, backoff_period=30.0)
+    _, poller = make_poller(task)
+    poller.on_answer("info")
+    assert task.current_period == 30.0
+    assert task.next_due >= time.monotonic() + 29
+    # later answers don't push it further
+    task.next_due = 0
+    poller.on_answer("info")
+    assert task.next_due == 0
+
+
+def test_poll_queues_the_batch_coalesced():
+    task = PollTask("status", lambda: [["status"], ["status", {"id": 0}]], 1.0, target=5)
+    q, poller = make_poller(task)
+    poller.poll(task, time.monotonic())
+    poller.poll(task, time.monotonic())
+    assert q.qsize() == 2
+    assert q.coalesced == 2
+    assert q.get(0) == (["status"], 5)
+    assert task.batch_size == 2
+
+
+def test_missed_cycles_are_not_caught_up():
+    task = PollTask("status", lambda: [["status"]], 1.0)
+    _, poller = make_poller(task)
+    now = time.monotonic()
+    task.next_due = now - 10
+    poller.poll(task, now)
+    assert task.next_due == now
+
+
+def test_timeouts_slow_an_adaptive_task_down_and_answers_speed_it_up():
+    task = PollTask("status", lambda: [["status"]], 1.0, adaptive=True)
+    _, poller = make_poller(task)
+    for _ in range(30):
+        poller.on_result(["status"], None, 0.01, True)
+        poller.poll(task, time.monotonic())
+    assert task.slowdown == PollScheduler.MAX_SLOWDOWN
+    assert task.current_period == PollScheduler.MAX_SLOWDOWN
+    for _ in range(60):
+        poller.on_result(["status"], None, 0.01, False)
+        poller.poll(task, time.monotonic())
+    assert task.slowdown == 1
+    assert task.current_period == 1.0
+
+
+def test_adaptive_period_keeps_the_link_share():
+    commands = [["status", {"id": i}] for i in range(16)]
+    task = PollTask("status", lambda: commands, 0.1, adaptive=True)
+    _, poller = make_poller(task)
+    poller.poll(task, time.monotonic())
+    poller.on_result(["status", {"id": 0}], None, 0.05, False)
+    poller.poll(task, time.monotonic())
+    assert task.current_period == pytest.approx(0.05 * 16 / PollScheduler.MAX_LINK_SHARE)
+
+
+def test_next_task_is_the_earliest_due():
+    first = PollTask("status", lambda: [], 1.0, target=1)
+    second = PollTask("status", lambda: [], 1.0, target=2)
+    _, poller = make_poller(first)
+    poller.add(second, offset=-1.0)
+    assert poller.next_task() is second
+    poller.remove("status", 2)
+    assert poller.next_task() is first
+
+
+def test_histogram_percentiles():
+    h = LatencyHistogram()
+    for _ in range(98):
+        h.add(0.001)
+    h.add(0.5)
+    h.add(2.0)
+    summary = h.summary()
+    assert summary["count"] == 100
+    assert summary["max"] == 2.0
+    assert summary["mean"] == pytest.approx((98 * 0.001 + 2.5) / 100)
+    # the upper limit of the bucket, at most 26% over the latency
+    assert 0.001 <= summary["p50"] <= 0.00126
+    assert 0.5 <= summary["p99"] <= 0.63
+    assert h.percentile(100) == 2.0
+
+
+def test_histogram_empty_and_extremes():
+    h = LatencyHistogram()
+    assert h.percentile(50) is None
+    assert h.summary()["mean"] is None
+    h.add(0.0)
+    h.add(1000.0)
+    assert h.counts[0] == 1
+    assert h.counts[LatencyHistogram.BUCKETS] == 1
+
+
+def test_window_matches_answers_by_kind_and_cell():
+    window = InFlightWindow(4)
+    status = window.begin(["status"], target=1)
+    cell = window.begin(["status", {"id": 3}], target=2)
+    info = window.begin(["info"], target=3)
+    assert window.outstanding() == 3
+    assert window.match({"id": 3, "v": 3300, "t": 25}) is cell
+    assert window.match({"flags": 0}) is status
+    assert window.match({"name": "BMS3"}) is info
+    assert window.match({"name": "BAL3"}) is None
+    # answered once only
+    assert window.match({"id": 3, "v": 3300, "t": 25}) is None
+    for entry in (status, cell, info):
+        window.end(entry, False)
+    assert window.outstanding() == 0
+    assert set(window.summary()) == {"status", "status id", "info"}
+
+
+def test_window_keeps_one_request_per_answer_key():
+    window = InFlightWindow(4)
+    first = window.begin(["status", {"id": 3}], target=1)
+    assert not window.free(["status", {"id": 3}])
+    assert window.free(["status", {"id": 4}])
+    entered = threading.Event()
+    second = []
+
+    def other_device():
+        second.append(window.begin(["status", {"id": 3}], target=2))
+        entered.set()
+
+    threading.Thread(target=other_device, daemon=True).start()
+    assert not entered.wait(0.1)
+    window.end(first, False)
+    assert entered.wait(5)
+    assert window.match({"id": 3, "v": 0, "t": 0})[4] == 2
+
+
+def test_window_is_bounded_by_its_size():
+    window = InFlightWindow(2)
+    entries = [window.begin(["status", {"id": i}]) for i in range(2)]
+    assert not window.free(["info"])
+    window.end(entries[0], True)
+    assert window.free(["info"])
+    assert window.summary()["status id"]["timeouts"] == 1
@@ -0,0 +1,122 @@
+import threading
+
+import numpy as np
+import pytest
+
+from shared_state import SharedState, SharedRing
+
+
+@pytest.fixture
+def state():
+    state = SharedState(8)
+    yield state
+    state.close()
+
+
+@pytest.fixture
+def ring():
+    ring = SharedRing(64)
+    yield ring
+    ring.close()
+
+
+def test_cells_and_versions(state):
+    state.write_cell(2, 3300, 25)
+    state.write_cell(8, 1, 1)
+    seq, data = state.read()
+    assert seq == state.seq and seq % 2 == 0
+    versions, v, t = state.cells_of(data)
+    assert (v[2], t[2]) == (3300, 25)
+    assert versions[2] == seq - 1
+    assert not versions[:2].any() and not versions[3:].any()
+
+
+def test_slots(state):
+    seq, data = state.read()
+    assert state.slot_of(data, "on_status_handler") == (0, None)
+    assert state.write_slot("on_status_handler", ({"soc": 80, "dvdt": np.array([1.5, 2.0])},))
+    assert state.write_slot("on_status_handler", ({"soc": 81},))
+    _, data = state.read()
+    assert state.slot_of(data, "on_status_handler") == (2, [{"soc": 81}])
+
+
+def test_oversized_slot_is_counted(state):
+    assert not state.write_slot("on_devices_handler", ("x" * SharedState.SLOT_SIZE,))
+    assert state.dropped == 1
+    _, data = state.read()
+    assert state.slot_of(data, "on_devices_handler") == (0, None)
+
+
+def test_attach_by_name(state):
+    other = SharedState(8, state.name)
+    try:
+        state.write_cell(0, 4000, 30)
+        _, data = other.read()
+        assert other.cells_of(data)[1][0] == 4000
+    finally:
+        other.close()
+
+
+def test_reader_never_sees_a_torn_write(state):
+    # every write keeps v == t, a copy mixing two writes would break it
+    stop = threading.Event()
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            i += 1
+            for cell in range(state.cells):
+                state.write_cell(cell, i, i)
+
+    thread = threading.Thread(target=writer, daemon=True)
+    thread.start()
+    try:
+        checked = 0
+        for _ in range(2000):
+            seq, data = state.read()
+            if seq is None:
+                continue
+            _, v, t = state.cells_of(data)
+            assert (v == t).all()
+            checked += 1
+        assert checked
+    finally:
+        stop.set()
+        thread.join()
+
+
+def test_read_gives_up_while_a_write_is_open(state, monkeypatch):
+    monkeypatch.setattr(SharedState, "READ_RETRIES", 3)
+    with state._SharedState__write():
+        assert state.read() == (None, None)
+    assert state.read()[0] is not None
+
+
+def test_ring_reads_what_was_written(ring):
+    ring.write(b"hello ")
+    position, data, lost = ring.read(0)
+    assert (position, data, lost) == (6, b"hello ", 0)
+    ring.write(b"world")
+    assert ring.read(position) == (11, b"world", 0)
+    assert ring.read(11) == (11, b"", 0)
+
+
+def test_ring_wraps_around(ring):
+    ring.write(b"a" * 60)
+    position, _, _ = ring.read(0)
+    ring.write(b"0123456789")
+    assert ring.read(position) == (70, b"0123456789", 0)
+
+
+def test_ring_reader_that_fell_behind_loses_the_overwritten_part(ring):
+    ring.write(bytes(range(50)))
+    ring.write(bytes(range(50, 100)))
+    position, data, lost = ring.read(0)
+    assert position == 100
+    assert lost == 36
+    assert data == bytes(range(36, 100))
+
+
+def test_ring_write_larger_than_the_ring(ring):
+    ring.write(bytes(range(100)))
+    assert ring.read(0) == (100, bytes(range(36, 100)), 36)
@@ -0,0 +1,166 @@
+import os, re
+
+from trace_log import TraceLog, TraceWriter, TraceDecoder
+
+
+def fill(log:TraceLog, count:int, first:int=0):
+    for i in range(first, first + count):
+        log.append(f"{'BAL' if i % 3 == 0 else 'BMS'} line {i}\n")
+
+
+def test_lines_and_unterminated_tail():
+    log = TraceLog()
+    log.append("BMS one\nBMS tw")
+    log.append("o\nBAL thr")
+    assert log.get_lines() == ["BMS one", "BMS two", "BAL thr"]
+    assert log.count() == 3
+    # the unterminated line has no source yet
+    assert log.count("BMS") == 2
+    assert log.count("BAL") == 0
+    log.append("ee\n")
+    assert log.count("BAL") == 1
+    assert log.text() == "BMS one\nBMS two\nBAL three\n"
+
+
+def test_evicts_by_lines():
+    log = TraceLog(max_lines=100)
+    fill(log, 1000)
+    lines = log.get_lines()
+    assert len(lines) == log.count() == 100
+    assert lines[0] == "BMS line 901"
+    assert lines[-2] == "BAL line 999"
+    assert log.first_line == 901
+    assert log.end_line == 1001
+    assert log.get_entries(0, 1) == [(901, "BMS line 901")]
+
+
+def test_evicts_by_bytes():
+    log = TraceLog(max_lines=100000, max_bytes=1000)
+    fill(log, 1000)
+    assert len(log) <= 1000
+    assert log.text().endswith("BAL line 999\n")
+    assert log.text().startswith(log.get_lines()[0])
+
+
+def test_compaction_keeps_the_content():
+    log = TraceLog(max_lines=50)
+    fill(log, 20000)
+    assert log.get_lines()[:-1] == [f"{'BAL' if i % 3 == 0 else 'BMS'} line {i}" for i in range(19951, 20000)]
+    assert len(log._data) < 2 * TraceLog.COMPACT_SIZE
+
+
+def test_sources_index():
+    log = TraceLog()
+    fill(log, 30)
+    assert log.count("BAL") == 10
+    assert log.count("BMS") == 20
+    assert log.get_entries(0, 3, "BAL") == [(0, "BAL line 0"), (3, "BAL line 3"), (6, "BAL line 6")]
+    assert log.line_at(2, "BMS") == 4
+    assert log.index_of(4, "BAL") == 2
+
+
+def test_sources_after_eviction():
+    log = TraceLog(max_lines=10)
+    fill(log, 100)
+    entries = log.get_entries(0, log.count("BAL"), "BAL")
+    assert [n for n, _ in entries] == [93, 96, 99]
+    assert all(text == f"BAL line {n}" for n, text in entries)
+
+
+def test_find_forward_and_backward():
+    log = TraceLog()
+    fill(log, 100)
+    pattern = re.compile(rb"line 4\d")
+    assert log.find(pattern, -1) == 40
+    assert log.find(pattern, 40) == 41
+    assert log.find(pattern, 49) is None
+    assert log.find(pattern, 100, backward=True) == 49
+    assert log.find(pattern, 49, backward=True) == 48
+    assert log.find(pattern, 40, backward=True) is None
+
+
+def test_find_by_source():
+    log = TraceLog()
+    fill(log, 100)
+    pattern = re.compile(rb"line 4\d")
+    assert log.find(pattern, -1, source="BAL") == 42
+    assert log.find(pattern, 42, source="BMS") == 43
+    assert log.find(pattern, 100, backward=True, source="BAL") == 48
+
+
+def test_find_skips_evicted_lines():
+    log = TraceLog(max_lines=10)
+    fill(log, 100)
+    assert log.find(re.compile(rb"line 5\b"), -1) is None
+    assert log.find(re.compile(rb"line 95"), -1) == 95
+    assert log.find(re.compile(rb"line 9"), 1000, backward=True) == 99
+
+
+def test_clear():
+    log = TraceLog()
+    fill(log, 10)
+    version = log.version
+    log.clear()
+    assert log.get_lines() == [""]
+    assert log.count() == 1
+    assert log.version > version
+
+
+def test_writer_rotates_by_bytes(tmp_path):
+    path = str(tmp_path / "trace.log")
+    writer = TraceWriter(path, max_size=1000, backups=3)
+    writer.start()
+    for _ in range(12):
+        # two bytes per character
+        writer.write("\u0436" * 100)
+        assert writer.flush()
+    writer.stop()
+    assert os.path.getsize(path + ".1") == 1000
+    assert os.path.getsize(path + ".2") == 1000
+    assert os.path.getsize(path) == 400
+    assert not os.path.exists(path + ".3")
+
+
+def test_writer_save_to_another_path(tmp_path):
+    path = str(tmp_path / "trace.log")
+    other = str(tmp_path / "saved.log")
+    writer = TraceWriter(path)
+    writer.start()
+    writer.write("BMS before\n")
+    assert writer.flush(other)
+    writer.write("BMS after\n")
+    writer.stop()
+    assert writer.path == other
+    with open(other, encoding="utf-8") as f:
+        assert f.read() == "BMS before\nBMS after\n"
+
+
+def test_decoder_keeps_a_split_character():
+    decoder = TraceDecoder()
+    data = "BMS \u0394V=5 \u00b0C\n".encode("utf-8")
+    # every split point, including inside the two byte characters
+    for cut in range(len(data) + 1):
+        assert decoder.decode(data[:cut]) + decoder.decode(data[cut:]) == "BMS \u0394V=5 \u00b0C\n"
+
+
+def test_decoder_byte_by_byte():
+    decoder = TraceDecoder()
+    data = "\u20ac\U0001f50b ok".encode("utf-8")
+    assert "".join(decoder.decode(data[i:i + 1]) for i in range(len(data))) == "\u20ac\U0001f50b ok"
+
+
+def test_decoder_strips_carriage_returns():
+    decoder = TraceDecoder()
+    assert decoder.decode(b"a\r\nb\r") == "a\nb"
+    assert decoder.decode(bytearray(b"c\r\n")) == "c\n"
+    assert decoder.decode("d\r\n") == "d\n"
+    assert decoder.decode(None) == ""
+
+
+def test_decoder_replaces_invalid_bytes():
+    decoder = TraceDecoder()
+    assert decoder.decode(b"a\xffb") == "a\ufffdb"
+    # a started character that never completes is dropped on reset
+    assert decoder.decode(b"x\xe2\x82") == "x"
+    decoder.reset()
+    assert decoder.decode(b"y") == "y"
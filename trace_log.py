@@ -0,0 +1,379 @@
+import os, codecs, gzip, pathlib, shutil, threading, queue, time, bisect
+from array import array
+
+
+def default_trace_path() -> str:
+    path_to_trace = pathlib.Path(__file__).parent.resolve()
+    if os.name == "nt":
+        return str(path_to_trace) + "\\traces.log"
+    return str(path_to_trace) + "/traces.log"
+
+
+class TraceDecoder:
+    # Trace chunks of the device to text. A character split between two frames is kept until the
+    # next one completes it, carriage returns go before decoding, in one pass over the chunk.
+    def __init__(self):
+        self.__decoder = codecs.getincrementaldecoder("utf-8")("replace")
+
+    def decode(self, chunk) -> str:
+        if isinstance(chunk, (bytes, bytearray, memoryview)):
+            return self.__decoder.decode(bytes(chunk).replace(b"\r", b""))
+        if chunk is None:
+            return ""
+        # already text, e.g. from a capture of an older version
+        return str(chunk).replace("\r", "")
+
+    def reset(self):
+        self.__decoder.reset()
+
+
+class TraceLog:
+    # The trace kept in memory as one UTF-8 buffer plus the offsets where its lines start, so a
+    # view can fetch any window of lines or search without splitting the whole text.
+    DEFAULT_MAX_LINES = 10000
+    DEFAULT_MAX_BYTES = 4 * 1024 * 1024
+    SOURCES = ("BMS", "BAL")
+    COMPACT_SIZE = 64 * 1024
+    SEARCH_WINDOW = 64 * 1024
+
+    def __init__(self, max_lines:int=DEFAULT_MAX_LINES, max_bytes:int=DEFAULT_MAX_BYTES):
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # bumped on every change, lets a view skip redraws of an unchanged trace
+        self.version = 0
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._data = bytearray()
+            # absolute offset of self._data[0], grows when the evicted prefix is dropped
+            self._base = 0
+            # absolute start offsets of the complete lines, the first self._dead are evicted
+            self._starts = array("q")
+            self._dead = 0
+            # absolute number of the first live line
+            self._first = 0
+            # absolute start offset of the unterminated last line
+            self._end = 0
+            # absolute line numbers of the complete lines per source
+            self._sources = {source: array("q") for source in self.SOURCES}
+            self._sources_dead = dict.fromkeys(self.SOURCES, 0)
+            self.version += 1
+
+    @staticmethod
+    def source_of(line:bytes) -> str:
+        # the balancer's lines are tagged with BAL, everything else comes from the BMS
+        return "BAL" if line[:3] == b"BAL" else "BMS"
+
+    def append(self, trace:str):
+        if not trace:
+            return
+        chunk = trace.encode("utf-8")
+        with self._lock:
+            offset = self._base + len(self._data)
+            self._data += chunk
+            i = chunk.find(b"\n")
+            while i != -1:
+                start = self._end - self._base
+                self._sources[self.source_of(self._data[start:start + 3])].append(self._first + len(self._starts) - self._dead)
+                self._starts.append(self._end)
+                self._end = offset + i + 1
+                i = chunk.find(b"\n", i + 1)
+            self.__evict()
+            self.version += 1
+
+    def __evict(self):
+        count = len(self._starts) - self._dead
+        if not count:
+            return
+        dead = self._dead + count - self.max_lines + 1 if count >= self.max_lines else self._dead
+        # every line starting before this offset has to go to fit max_bytes
+        dead = max(dead, bisect.bisect_left(self._starts, self._base + len(self._data) - self.max_bytes, self._dead))
+        dead = min(dead, len(self._starts))
+        if dead == self._dead:
+            return
+        self._first += dead - self._dead
+        self._dead = dead
+        for source, lines in self._sources.items():
+            self._sources_dead[source] = bisect.bisect_left(lines, self._first, self._sources_dead[source])
+        if self._dead > len(self._starts) // 2 and self._dead * 8 > self.COMPACT_SIZE:
+            self.__compact()
+
+    def __compact(self):
+        # drop the evicted prefix in one go, amortised over many evictions
+        del self._starts[:self._dead]
+        self._dead = 0
+        for source, lines in self._sources.items():
+            del lines[:self._sources_dead[source]]
+            self._sources_dead[source] = 0
+        cut = self.__live_start() - self._base
+        if cut > self.COMPACT_SIZE:
+            del self._data[:cut]
+            self._base += cut
+
+    def __live_start(self) -> int:
+        return self._starts[self._dead] if self._dead < len(self._starts) else self._end
+
+    def __line_start(self, line:int) -> int:
+        k = self._dead + line - self._first
+        return self._starts[k] if k < len(self._starts) else self._end
+
+    def __line_of(self, offset:int) -> int:
+        if offset >= self._end:
+            return self._first + len(self._starts) - self._dead
+        return self._first + bisect.bisect_right(self._starts, offset, self._dead) - 1 - self._dead
+
+    def __line(self, line:int) -> str:
+        k = self._dead + line - self._first
+        start = self._starts[k] - self._base
+        stop = (self._starts[k + 1] if k + 1 < len(self._starts) else self._end) - self._base - 1
+        return self._data[start:stop].decode("utf-8", "replace")
+
+    def __source(self, line:int) -> str:
+        # None for the unterminated last line, it is not filed under a source yet
+        k = self._dead + line - self._first
+        if k >= len(self._starts):
+            return None
+        start = self._starts[k] - self._base
+        return self.source_of(self._data[start:start + 3])
+
+    def __tail(self) -> str:
+        return self._data[self._end - self._base:].decode("utf-8", "replace")
+
+    @property
+    def first_line(self) -> int:
+        return self._first
+
+    @property
+    def end_line(self) -> int:
+        # one past the absolute number of the last (possibly unterminated) line
+        return self._first + len(self._starts) - self._dead + 1
+
+    def get_lines(self, start:int=None, stop:int=None) -> list:
+        with self._lock:
+            return self.__get_lines(start, stop)
+
+    def __get_lines(self, start:int=None, stop:int=None) -> list:
+        last = self._first + len(self._starts) - self._dead
+        start = self._first if start is None else max(start, self._first)
+        stop = last + 1 if stop is None else stop
+        lines = [self.__line(i) for i in range(start, min(stop, last))]
+        if start <= last < stop:
+            lines.append(self.__tail())
+        return lines
+
+    def count(self, source:str=None) -> int:
+        # live lines, the unterminated last one included when not filtering by source
+        if source is None:
+            return len(self._starts) - self._dead + 1
+        return len(self._sources[source]) - self._sources_dead[source]
+
+    def line_at(self, index:int, source:str=None) -> int:
+        # absolute number of the index-th live line of the source
+        if source is None:
+            return self._first + index
+        with self._lock:
+            lines = self._sources[source]
+            # clamped, lines may have been evicted since the caller counted them
+            return lines[min(self._sources_dead[source] + index, len(lines) - 1)] if lines else self._first
+
+    def index_of(self, line:int, source:str=None) -> int:
+        # index of the first live line of the source at or after the absolute line number
+        if source is None:
+            return max(line - self._first, 0)
+        with self._lock:
+            dead = self._sources_dead[source]
+            return bisect.bisect_left(self._sources[source], line, dead) - dead
+
+    def get_entries(self, start:int, stop:int, source:str=None) -> list:
+        # -> [(absolute line number, text)] for the live lines of the source from index start to stop
+        with self._lock:
+            if source is None:
+                start = self._first + max(start, 0)
+                return list(zip(range(start, self._first + stop), self.__get_lines(start, self._first + stop)))
+            lines = self._sources[source]
+            dead = self._sources_dead[source]
+            numbers = lines[dead + max(start, 0):dead + max(stop, 0)]
+            return [(n, self.__line(n)) for n in numbers]
+
+    def find(self, pattern, line:int, backward:bool=False, source:str=None):
+        # -> absolute number of the nearest line after (before) line matching the compiled bytes
+        # pattern, None if there is none
+        with self._lock:
+            if backward:
+                return self.__find_backward(pattern, line, source)
+            last = self._first + len(self._starts) - self._dead
+            line = max(line + 1, self._first)
+            while line <= last:
+                match = pattern.search(self._data, self.__line_start(line) - self._base)
+                if not match:
+                    return None
+                line = self.__line_of(match.start() + self._base)
+                if source is None or self.__source(line) == source:
+                    return line
+                line += 1
+            return None
+
+    def __find_backward(self, pattern, line:int, source:str=None):
+        last = self._first + len(self._starts) - self._dead
+        if line <= self._first:
+            return None
+        end = self.__line_start(min(line, last)) if line <= last else self._base + len(self._data)
+        live_start = self.__live_start()
+        window = self.SEARCH_WINDOW
+        while end > live_start:
+            # search back in growing windows cut at line starts, the last hit is the nearest one
+            start = self.__line_start(max(self.__line_of(max(end - window, live_start)), self._first))
+            found = None
+            for match in pattern.finditer(self._data, start - self._base, end - self._base):
+                hit = self.__line_of(match.start() + self._base)
+                if source is None or self.__source(hit) == source:
+                    found = hit
+            if found is not None:
+                return found
+            end = start
+            window *= 2
+        return None
+
+    def text(self) -> str:
+        with self._lock:
+            return self._data[self.__live_start() - self._base:].decode("utf-8", "replace")
+
+    def __len__(self):
+        return self._base + len(self._data) - self.__live_start()
+
+
+class TraceWriter(threading.Thread):
+    DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+    DEFAULT_BACKUPS = 5
+    BUFFER_SIZE = 256 * 1024
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, path:str, max_size:int=DEFAULT_MAX_SIZE, max_age:float=None, compress:bool=False,
+                 backups:int=DEFAULT_BACKUPS):
+        super().__init__(group=None, name="trace_writer", daemon=True)
+        self.path = path
+        self.max_size = max_size
+        self.max_age = max_age
+        self.compress = compress
+        self.backups = backups
+        self.error = None
+        self.__chunks = queue.Queue()
+        self.__file = None
+
+    def write(self, trace:str):
+        if trace:
+            self.__chunks.put(trace)
+
+    def flush(self, path:str=None, timeout:float=2.0) -> bool:
+        done = threading.Event()
+        self.__chunks.put((path, done))
+        return done.wait(timeout) and self.error is None
+
+    def stop(self):
+        self.do_run = False
+        self.__chunks.put(None)
+        if self.is_alive():
+            self.join()
+
+    def run(self):
+        t = threading.current_thread()
+        while True:
+            idle = False
+            try:
+                chunk = self.__chunks.get(timeout=self.FLUSH_INTERVAL)
+            except queue.Empty:
+                chunk, idle = "", True
+            # drain everything queued so far into one buffered write
+            batch = []
+            while type(chunk) == str:
+                batch.append(chunk)
+                try:
+                    chunk = self.__chunks.get_nowait()
+                except queue.Empty:
+                    chunk = ""
+                    break
+            self.__write("".join(batch))
+            if type(chunk) == tuple:
+                path, done = chunk
+                self.__flush(path)
+                done.set()
+            elif chunk is None or not getattr(t, "do_run", True):
+                break
+            elif idle and self.__file:
+                # push buffered data out and honour time based rotation
+                self.__flush(None)
+        self.__close()
+
+    def __write(self, data:str):
+        if not data:
+            return
+        try:
+            # max_size is in bytes, a character of the trace can take several
+            size = len(data.encode("utf-8"))
+            if self.__file is None:
+                self.__open()
+            elif self.__need_rotation(size):
+                self.__rotate()
+            self.__file.write(data)
+            self.__size += size
+            self.error = None
+        except OSError as e:
+            self.error = e
+            self.__close()
+
+    def __flush(self, path:str):
+        try:
+            if path and path != self.path:
+                # Save to another file: it gets the trace written so far, then the trace goes on there
+                had_file = self.__file is not None
+                self.__close()
+                if had_file:
+                    shutil.copyfile(self.path, path)
+                self.path = path
+                self.__open()
+            elif self.__file:
+                self.__file.flush()
+                if self.__need_rotation(0):
+                    self.__rotate()
+            else:
+                return
+            self.error = None
+        except OSError as e:
+            self.error = e
+            self.__close()
+
+    def __need_rotation(self, size:int) -> bool:
+        if self.max_size and self.__size + size > self.max_size and self.__size:
+            return True
+        return bool(self.max_age and time.time() - self.__opened > self.max_age and self.__size)
+
+    def __open(self):
+        self.__file = open(self.path, "a", buffering=self.BUFFER_SIZE, encoding="utf-8", newline="")
+        self.__size = self.__file.tell()
+        self.__opened = time.time()
+
+    def __close(self):
+        if self.__file:
+            try:
+                self.__file.close()
+            except OSError as e:
+                self.error = e
+            self.__file = None
+
+    def __backup_name(self, i:int) -> str:
+        return f"{self.path}.{i}.gz" if self.compress else f"{self.path}.{i}"
+
+    def __rotate(self):
+        self.__close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(self.__backup_name(i)):
+                os.replace(self.__backup_name(i), self.__backup_name(i + 1))
+        if self.compress:
+            with open(self.path, "rb") as src, gzip.open(self.__backup_name(1), "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self.__backup_name(1))
+        self.__open()
@@ -0,0 +1,207 @@
+import re
+
+from wcwidth import wcwidth
+from asciimatics.widgets import Widget
+from asciimatics.event import KeyboardEvent
+from asciimatics.screen import Screen
+
+from trace_log import TraceLog
+
+
+def fit_width(text:str, width:int, unicode_aware:bool=True) -> str:
+    # the longest start of text that takes at most width cells, wide (CJK) characters take two
+    if len(text) <= width and (not unicode_aware or 2 * len(text) <= width):
+        return text
+    if not unicode_aware:
+        return text[:width]
+    size = 0
+    for i, char in enumerate(text):
+        size += wcwidth(char) if ord(char) >= 256 else 1
+        if size > width:
+            return text[:i]
+    return text
+
+
+class TraceView(Widget):
+    # Shows a window of a TraceLog: only the lines on screen are fetched from the store and wrapped
+    # when drawn, so a redraw costs the same with ten lines or millions. While following it sticks
+    # to the end of the trace, paused it stays on the absolute line at its top.
+    def __init__(self, height:int, store:TraceLog, name:str=None, line_wrap:bool=True, on_change=None):
+        super().__init__(name, tab_stop=True)
+        self._required_height = height
+        self.store = store
+        self.line_wrap = line_wrap
+        # called when follow, source or match change, e.g. to update the buttons
+        self.on_change = on_change
+        self.follow = True
+        # None shows every line, "BMS" or "BAL" only the lines of that source
+        self.source = None
+        # compiled bytes pattern for the store and str pattern for highlighting
+        self.pattern = None
+        self.__text_pattern = None
+        # absolute number of the current match
+        self.match = None
+        # absolute number of the first line shown while paused
+        self.top = None
+        self.__origin = None
+        self.__shown = (None, None)
+
+    def required_height(self, offset, width):
+        return self._required_height
+
+    def reset(self):
+        pass
+
+    @property
+    def value(self):
+        # the trace lives in the store, don't let a frame save copy it
+        return None
+
+    @value.setter
+    def value(self, new_value):
+        pass
+
+    def __wrap(self, text:str, width:int) -> list:
+        if not self.line_wrap:
+            return [fit_width(text, width, self._frame.canvas.unicode_aware)]
+        chunks = []
+        while self.string_len(text) > width:
+            chunk = fit_width(text, width, self._frame.canvas.unicode_aware)
+            chunks.append(chunk)
+            text = text[len(chunk):]
+        chunks.append(text)
+        return chunks
+
+    def __rows(self, width:int, height:int) -> list:
+        # -> [(absolute line number, text)], one entry per screen row
+        rows = []
+        if self.follow:
+            count = self.store.count(self.source)
+            for line, text in reversed(self.store.get_entries(count - height, count, self.source)):
+                rows[0:0] = [(line, chunk) for chunk in self.__wrap(text, width)]
+                if len(rows) >= height:
+                    break
+            return rows[-height:]
+        index = self.store.index_of(self.top, self.source) if self.top is not None else 0
+        for line, text in self.store.get_entries(index, index + height, self.source):
+            rows.extend((line, chunk) for chunk in self.__wrap(text, width))
+            if len(rows) >= height:
+                break
+        return rows[:height]
+
+    def update(self, frame_no):
+        self._draw_label()
+        width = self._w - self._offset
+        if width <= 0:
+            return
+        palette = self._frame.palette
+        canvas = self._frame.canvas
+        rows = self.__rows(width, self._h)
+        if rows:
+            self.__shown = (rows[0][0], rows[-1][0])
+        matches = {}
+        for i in range(self._h):
+            line, text = rows[i] if i < len(rows) else (None, "")
+            colour = "field"
+            if line is not None and self.__text_pattern is not None:
+                if line not in matches:
+                    # highlight the whole line, the match may sit on another of its rows
+                    matches[line] = bool(self.__text_pattern.search("".join(t for n, t in rows if n == line)))
+                if line == self.match:
+                    colour = "selected_focus_field"
+                elif matches[line]:
+                    colour = "selected_field"
+            fg, attr, bg = palette[colour]
+            canvas.paint(text + " " * (width - self.string_len(text)), self._x + self._offset, self._y + i, fg, attr, bg)
+
+    def __changed(self):
+        if self.on_change:
+            self.on_change()
+
+    def set_follow(self, follow:bool):
+        if not follow and self.follow:
+            self.top = self.__shown[0]
+        self.follow = follow
+        self.__changed()
+
+    def set_source(self, source:str):
+        self.source = source
+        if self.match is not None and source is not None and not self.__matches_source(self.match):
+            self.match = None
+        self.__changed()
+
+    def __matches_source(self, line:int) -> bool:
+        lines = self.store.get_lines(line, line + 1)
+        return bool(lines) and self.store.source_of(lines[0][:3].encode("utf-8")) == self.source
+
+    def scroll(self, delta:int):
+        self.set_follow(False)
+        count = self.store.count(self.source)
+        if not count:
+            return
+        index = self.store.index_of(self.top, self.source) if self.top is not None else 0
+        self.top = self.store.line_at(min(max(index + delta, 0), count - 1), self.source)
+
+    def search(self, text:str) -> bool:
+        # incremental: every edit of the pattern searches again from where the search began
+        if not text:
+            self.pattern = self.__text_pattern = self.match = self.__origin = None
+            self.__changed()
+            return True
+        try:
+            pattern, text_pattern = re.compile(text.encode("utf-8")), re.compile(text)
+        except re.error:
+            return False
+        self.pattern, self.__text_pattern = pattern, text_pattern
+        if self.__origin is None:
+            self.__origin = self.__shown[0] if self.__shown[0] is not None else self.store.first_line
+        self.match = None
+        return self.find(start=self.__origin - 1)
+
+    def find(self, backward:bool=False, start:int=None) -> bool:
+        if self.pattern is None:
+            return False
+        if start is None:
+            start = self.match
+        if start is None:
+            # nothing found yet: from the lines on screen
+            first, last = self.__shown
+            if backward:
+                start = last + 1 if last is not None else self.store.end_line
+            else:
+                start = first - 1 if first is not None else self.store.first_line - 1
+        line = self.store.find(self.pattern, start, backward, self.source)
+        if line is None:
+            # wrap around the end of the trace
+            line = self.store.find(self.pattern, self.store.end_line if backward else self.store.first_line - 1,
+                                   backward, self.source)
+        if line is None:
+            self.__changed()
+            return False
+        self.match = line
+        # show the match a few lines below the top
+        self.follow = False
+        index = self.store.index_of(line, self.source)
+        self.top = self.store.line_at(max(index - self._h // 3, 0), self.source)
+        self.__changed()
+        return True
+
+    def process_event(self, event):
+        if isinstance(event, KeyboardEvent):
+            if event.key_code == Screen.KEY_UP:
+                self.scroll(-1)
+            elif event.key_code == Screen.KEY_DOWN:
+                self.scroll(1)
+            elif event.key_code == Screen.KEY_PAGE_UP:
+                self.scroll(-self._h)
+            elif event.key_code == Screen.KEY_PAGE_DOWN:
+                self.scroll(self._h)
+            elif event.key_code == Screen.KEY_HOME:
+                self.set_follow(False)
+                self.top = self.store.first_line
+            elif event.key_code == Screen.KEY_END:
+                self.set_follow(True)
+            else:
+                return event
+            return None
+        return event
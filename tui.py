@@ -8,6 +8,8 @@ from asciimatics.exceptions import ResizeScreenError, NextScene, StopApplication
     InvalidFields
 import sys
 
+from render import RedrawScheduler
+
 # Initial data for the form
 form_data = {
     "TA": ["Hello world!", "How are you?"],
@@ -109,16 +111,20 @@ scenes = [
     Scene([ frame ]),
 ]
 screen.set_scenes(scenes)
+redraw = RedrawScheduler()
+next_data = time.time()
 while True:
     try:
-        screen.draw_next_frame(repeat=True)
-        time.sleep(1)
+        redraw.draw(screen, stop_on_resize=False)
+        if time.time() < next_data:
+            continue
+        next_data += 1
         new_data = {}
         for i in range(1, frame.MAX_ROW):
             new_data["v%d" % i] = "%.2f" % (random.randrange(2500, 3800) / 1000)
             new_data["t%d" % i] = "%d" % random.randrange(10, 48)
         frame.data = new_data
-        screen.force_update()
+        redraw.mark_dirty()
     except ResizeScreenError as e:
         last_scene = e.scene
     except StopApplication as e: